@@ -0,0 +1,88 @@
+import heapq
+import threading
+from datetime import datetime, timedelta
+
+class AlertSchedule:
+    """Min-heap of (next alert due time, camera id).
+
+    A camera is only in the heap while it is Offline and some channel can still
+    alert: due is last_online + first-alert delay, then last alert + frequency,
+    until the mute count is reached. Entries are refreshed with update() when a
+    camera changes state or an alert fires; superseded entries are skipped lazily.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.due = {}
+        self.version = None
+        self.touched = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _channel_due(cam, count, last, delay, freq, mute):
+        if count >= mute: return None
+        if count == 0:
+            # Without a last_online the downtime reads as 0, so only a zero delay fires
+            if cam.last_online is None: return datetime.min if delay <= 0 else None
+            return cam.last_online + timedelta(minutes=delay)
+        if last is None: return datetime.min if freq <= 0 else None
+        return last + timedelta(minutes=freq)
+
+    def next_due_for(self, cam, cfg):
+        if cam.status != "Offline": return None
+        low = cam.importance == 1
+        times = [
+            self._channel_due(cam, cam.telegram_alert_count, cam.telegram_last_alert, cfg.tele_low_delay if low else cfg.tele_delay, cfg.tele_freq, cfg.tele_mute),
+            self._channel_due(cam, cam.mail_alert_count, cam.mail_last_alert, cfg.mail_low_delay if low else cfg.mail_delay, cfg.mail_freq, cfg.mail_mute),
+        ]
+        times = [t for t in times if t is not None]
+        return min(times) if times else None
+
+    def rebuild(self, cams, cfg):
+        self.due = {}
+        for cam in cams:
+            due = self.next_due_for(cam, cfg)
+            if due is not None: self.due[cam.id] = due
+        self.heap = [(due, cid) for cid, due in self.due.items()]
+        heapq.heapify(self.heap)
+        self.version = cfg.version
+
+    def update(self, cam, cfg):
+        due = self.next_due_for(cam, cfg)
+        if due is None:
+            self.due.pop(cam.id, None)
+            return
+        if self.due.get(cam.id) == due: return
+        self.due[cam.id] = due
+        heapq.heappush(self.heap, (due, cam.id))
+        if len(self.heap) > 2 * len(self.due) + 1024:
+            self.heap = [(d, cid) for cid, d in self.due.items()]
+            heapq.heapify(self.heap)
+
+    def _skip_stale(self):
+        while self.heap and self.due.get(self.heap[0][1]) != self.heap[0][0]: heapq.heappop(self.heap)
+
+    def next_due(self):
+        self._skip_stale()
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now):
+        """Camera ids whose alert time has come; they leave the heap until update()d."""
+        ids = []
+        while True:
+            self._skip_stale()
+            if not self.heap or self.heap[0][0] > now: return ids
+            _, cid = heapq.heappop(self.heap)
+            del self.due[cid]
+            ids.append(cid)
+
+    def touch(self, cam_id):
+        # Called from API threads when a camera's alert inputs (e.g. importance) change
+        with self.lock: self.touched.add(cam_id)
+
+    def take_touched(self):
+        with self.lock:
+            ids, self.touched = self.touched, set()
+        return ids
+
+alert_schedule = AlertSchedule()
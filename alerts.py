@@ -2,31 +2,50 @@ import smtplib
 import requests
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from database import Session, engine, Settings
+from config import settings_cache
+from database import AlertOutbox
+from metrics import alerts_queued
 
 def get_config_dict():
-    with Session(engine) as session:
-        settings = session.query(Settings).all()
-        return {s.key: s.value for s in settings}
+    return settings_cache.get().raw
 
-def send_email_batch(subject, lines):
-    conf = get_config_dict()
-    if conf.get("MAIL_ENABLED") != "true" or not lines: return False
-    return send_email_raw(conf, subject, "<h3>System Alert</h3><ul>" + "".join([f"<li>{l}</li>" for l in lines]) + "</ul>")
+# --- OUTBOX ---
+# The monitor only queues alerts; dispatcher.py delivers them in the background.
+def queue_email_batch(session, subject, lines):
+    if not settings_cache.get().mail_enabled or not lines: return False
+    session.add(AlertOutbox(channel="mail", subject=subject, body=format_email(lines)))
+    alerts_queued.labels("mail").inc()
+    return True
 
+def queue_telegram_batch(session, header, lines):
+    if not settings_cache.get().tele_enabled or not lines: return False
+    session.add(AlertOutbox(channel="telegram", subject=header, body=format_telegram(header, lines)))
+    alerts_queued.labels("telegram").inc()
+    return True
+
+def format_email(lines):
+    return "<h3>System Alert</h3><ul>" + "".join([f"<li>{l}</li>" for l in lines]) + "</ul>"
+
+def format_telegram(header, lines):
+    return f"*{header}*\n" + "\n".join(lines)
+
+def build_email(conf, subject, body):
+    sender = conf.get("MAIL_USER")
+    recipients = conf.get("MAIL_RECIPIENTS", "").split(",")
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['To'] = ", ".join(recipients)
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'html'))
+    return sender, recipients, msg
+
+# --- DIRECT SEND (used by /api/test) ---
 def send_email_raw(conf, subject, body):
     try:
-        sender = conf.get("MAIL_USER")
-        recipients = conf.get("MAIL_RECIPIENTS", "").split(",")
         server = conf.get("MAIL_SERVER")
         port = int(conf.get("MAIL_PORT", 587))
         password = conf.get("MAIL_PASS")
-        
-        msg = MIMEMultipart()
-        msg['From'] = sender
-        msg['To'] = ", ".join(recipients)
-        msg['Subject'] = subject
-        msg.attach(MIMEText(body, 'html'))
+        sender, recipients, msg = build_email(conf, subject, body)
 
         with smtplib.SMTP(server, port) as s:
             s.starttls()
@@ -37,12 +56,6 @@ def send_email_raw(conf, subject, body):
         print(f"📧 Mail Error: {e}")
         return str(e)
 
-def send_telegram_batch(header, lines):
-    conf = get_config_dict()
-    if conf.get("TELEGRAM_ENABLED") != "true" or not lines: return False
-    msg = f"*{header}*\n" + "\n".join(lines)
-    return send_telegram_raw(conf, msg)
-
 def send_telegram_raw(conf, message):
     token = conf.get("TELEGRAM_BOT_TOKEN")
     raw_ids = conf.get("TELEGRAM_CHAT_IDS", "")
@@ -50,7 +63,7 @@ def send_telegram_raw(conf, message):
     
     if not token or not raw_ids: return "Missing Token/ID"
     
-    chat_ids = [c.strip() for c in raw_ids.split(",") if c.strip()]
+    chat_ids = telegram_chat_ids(conf)
     url = f"https://api.telegram.org/bot{token}/sendMessage"
     
     # Configure Proxy
@@ -65,4 +78,7 @@ def send_telegram_raw(conf, message):
             print(f"✈️ Telegram Error: {e}")
             errors.append(str(e))
             
-    return errors[0] if errors else True
\ No newline at end of file
+    return errors[0] if errors else True
+
+def telegram_chat_ids(conf):
+    return [c.strip() for c in conf.get("TELEGRAM_CHAT_IDS", "").split(",") if c.strip()]
@@ -0,0 +1,171 @@
+import asyncio
+import re
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+import aiohttp
+
+ALERT_STREAM_PATH = "/ISAPI/Event/notification/alertStream"
+READ_TIMEOUT = 90          # NVRs send heartbeats every few seconds; silence this long means a dead link
+MAX_RECONNECT_DELAY = 300
+MAX_BUFFER = 4 * 1024 * 1024
+
+# eventType (lowercased) -> the camera is offline while the event is active
+STATE_EVENTS = {"videoloss", "ipcdisconnect"}
+
+ChannelEvent = namedtuple("ChannelEvent", "event_type channel_id active")
+
+class MultipartParser:
+    """Incremental multipart/mixed parser: feed() raw chunks, get back complete (headers, body) parts.
+
+    Uses Content-Length when the part has one and falls back to scanning for the
+    next boundary (some firmwares omit it).
+    """
+
+    def __init__(self, boundary):
+        self.delim = b"--" + boundary.encode()
+        self.buf = bytearray()
+        self.closed = False
+
+    def feed(self, data):
+        if self.closed: return []
+        self.buf += data
+        if len(self.buf) > MAX_BUFFER: del self.buf[:-len(self.delim)]
+        parts = []
+        while True:
+            start = self.buf.find(self.delim)
+            if start < 0:
+                del self.buf[:-len(self.delim)]
+                break
+            after = start + len(self.delim)
+            if self.buf[after:after + 2] == b"--":
+                self.closed = True
+                self.buf.clear()
+                break
+            header_end = self.buf.find(b"\r\n\r\n", after)
+            if header_end < 0:
+                del self.buf[:start]
+                break
+            headers = {}
+            for line in bytes(self.buf[after:header_end]).decode("latin-1").split("\r\n"):
+                if ":" in line:
+                    k, v = line.split(":", 1)
+                    headers[k.strip().lower()] = v.strip()
+            body_start = header_end + 4
+            length = headers.get("content-length", "")
+            if length.isdigit():
+                end = body_start + int(length)
+                if len(self.buf) < end:
+                    del self.buf[:start]
+                    break
+                body = bytes(self.buf[body_start:end])
+                del self.buf[:end]
+            else:
+                end = self.buf.find(self.delim, body_start)
+                if end < 0:
+                    del self.buf[:start]
+                    break
+                body = bytes(self.buf[body_start:end]).rstrip(b"\r\n")
+                del self.buf[:end]
+            parts.append((headers, body))
+        return parts
+
+def parse_boundary(content_type):
+    m = re.search(r'boundary="?([^";]+)"?', content_type or "")
+    return m.group(1).strip() if m else None
+
+def parse_event(body):
+    """EventNotificationAlert XML -> ChannelEvent, or None for heartbeats and unrelated events."""
+    try: root = ET.fromstring(body)
+    except ET.ParseError: return None
+    fields = {el.tag.rsplit("}", 1)[-1]: (el.text or "").strip() for el in root.iter()}
+    event_type = fields.get("eventType", "").lower()
+    if event_type not in STATE_EVENTS: return None
+    channel = fields.get("dynChannelID") or fields.get("channelID") or ""
+    if not channel.isdigit() or int(channel) == 0: return None
+    return ChannelEvent(event_type, str(int(channel)), fields.get("eventState", "").lower() == "active")
+
+class EventStream:
+    """Holds one alertStream connection open and reconnects with backoff when it drops."""
+
+    def __init__(self, client, queue):
+        self.client = client
+        self.queue = queue
+        self.connected = False
+        self.error = None
+        self.task = asyncio.create_task(self._run())
+
+    async def _read(self):
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.client.timeout, sock_read=READ_TIMEOUT)
+        resp = await self.client.open(ALERT_STREAM_PATH, timeout)
+        try:
+            if resp.status != 200: raise RuntimeError(f"HTTP {resp.status}")
+            boundary = parse_boundary(resp.headers.get("Content-Type"))
+            if not boundary: raise RuntimeError("Not a multipart stream")
+            parser = MultipartParser(boundary)
+            self.connected, self.error = True, None
+            async for chunk in resp.content.iter_any():
+                for headers, body in parser.feed(chunk):
+                    if "xml" not in headers.get("content-type", "xml"): continue
+                    event = parse_event(body)
+                    if event: self.queue.put_nowait((self.client.ip, event))
+                if parser.closed: break
+        finally:
+            self.connected = False
+            resp.release()
+
+    async def _run(self):
+        failures = 0
+        while True:
+            try:
+                await self._read()
+                failures = 0
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                self.error = "Timeout"
+            except Exception as e:
+                self.error = str(e) or type(e).__name__
+            failures += 1
+            await asyncio.sleep(min(2 ** failures, MAX_RECONNECT_DELAY))
+
+    async def close(self):
+        self.task.cancel()
+        try: await self.task
+        except asyncio.CancelledError: pass
+
+class EventStreams:
+    """One EventStream per NVR, sharing the poller's clients (and digest nonces)."""
+
+    def __init__(self, poller):
+        self.poller = poller
+        self.queue = asyncio.Queue()
+        self.streams = {}
+
+    async def sync(self, nvrs):
+        """`nvrs` are (ip, user, password); an empty list stops every stream."""
+        wanted = {}
+        for ip, user, password in nvrs: wanted[ip] = self.poller.client(ip, user, password)
+        for ip in [ip for ip, s in self.streams.items() if wanted.get(ip) is not s.client]:
+            await self.streams.pop(ip).close()
+        for ip, client in wanted.items():
+            if ip not in self.streams: self.streams[ip] = EventStream(client, self.queue)
+
+    def connected(self, ip):
+        s = self.streams.get(ip)
+        return bool(s and s.connected)
+
+    def drain(self):
+        events = []
+        while not self.queue.empty(): events.append(self.queue.get_nowait())
+        return events
+
+    async def wait(self, timeout):
+        """Events that arrive within `timeout` seconds (plus any already queued)."""
+        if self.queue.empty():
+            try: events = [await asyncio.wait_for(self.queue.get(), timeout)]
+            except asyncio.TimeoutError: return []
+        else: events = []
+        return events + self.drain()
+
+    async def close(self):
+        await self.sync([])
@@ -0,0 +1,110 @@
+import gzip
+import json
+import os
+import threading
+from collections import defaultdict, deque
+from datetime import datetime
+
+ARCHIVE_DIR = "data/archive"
+DATETIME_FIELDS = ("timestamp", "start_time", "end_time")
+DEDUP_WINDOW = 2000   # ids; a batch re-archived after a crash lands right after its first copy
+INDEX_FILE = "index.json"   # {"table-YYYY-MM": earliest start_time in that file}
+_index_lock = threading.Lock()
+
+def month_of(ts):
+    return ts.strftime("%Y-%m")
+
+def path(table, month):
+    return os.path.join(ARCHIVE_DIR, f"{table}-{month}.ndjson.gz")
+
+def months(table, first=None, last=None):
+    """Archived months of `table` ("YYYY-MM", oldest first), optionally limited to [first, last]."""
+    if not os.path.isdir(ARCHIVE_DIR): return []
+    prefix, suffix = f"{table}-", ".ndjson.gz"
+    found = sorted(n[len(prefix):-len(suffix)] for n in os.listdir(ARCHIVE_DIR) if n.startswith(prefix) and n.endswith(suffix))
+    return [m for m in found if (first is None or m >= first) and (last is None or m <= last)]
+
+def _load_index():
+    try:
+        with open(os.path.join(ARCHIVE_DIR, INDEX_FILE)) as f: return json.load(f)
+    except FileNotFoundError: return {}
+
+def _lower_index(entries):
+    """Merges {"table-YYYY-MM": iso start} into the index, keeping the earliest value per file."""
+    with _index_lock:
+        index = _load_index()
+        for k, v in entries.items(): index[k] = min(index.get(k, v), v)
+        tmp = os.path.join(ARCHIVE_DIR, INDEX_FILE + ".tmp")
+        with open(tmp, "w") as f: json.dump(index, f)
+        os.replace(tmp, os.path.join(ARCHIVE_DIR, INDEX_FILE))
+        return index
+
+def _earliest(index, table, month, field):
+    key = f"{table}-{month}"
+    if key not in index:
+        # Files archived before the index existed are scanned once
+        index = _lower_index({key: min((row[field] for row in read(table, month, month)), default=datetime.max).isoformat()})
+    return datetime.fromisoformat(index[key])
+
+def _encode(row):
+    return json.dumps({k: v.isoformat() if isinstance(v, datetime) else v for k, v in row.items()}, ensure_ascii=False)
+
+def append(table, rows, month_field, start_field=None):
+    """Appends dict rows to their monthly files, one gzip member per file, synced to disk.
+
+    With `start_field`, the index keeps each file's earliest value of it (see downtime_events).
+    """
+    by_month = defaultdict(list)
+    for row in rows: by_month[month_of(row[month_field])].append(row)
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    # Index first: a crash in between only leaves it too low, which costs a read, never a row
+    if start_field: _lower_index({f"{table}-{month}": min(r[start_field] for r in rs).isoformat() for month, rs in by_month.items()})
+    for month, rs in by_month.items():
+        data = gzip.compress(("\n".join(_encode(r) for r in rs) + "\n").encode(), compresslevel=6)
+        with open(path(table, month), "ab") as f:
+            size = f.tell()
+            try:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            except BaseException:
+                # Never leave half a member behind; it would hide everything appended after it
+                f.truncate(size)
+                raise
+
+def read(table, first=None, last=None):
+    """Yields archived rows (dicts, datetimes parsed) of the months in [first, last]."""
+    for month in months(table, first, last):
+        seen, order = set(), deque()
+        with gzip.open(path(table, month), "rt", encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                if row["id"] in seen: continue
+                seen.add(row["id"]); order.append(row["id"])
+                if len(order) > DEDUP_WINDOW: seen.discard(order.popleft())
+                for k in DATETIME_FIELDS:
+                    if row.get(k): row[k] = datetime.fromisoformat(row[k])
+                yield row
+
+def downtime_events(start=None, end=None, camera_ids=None):
+    """Archived DowntimeEvents overlapping [start, end).
+
+    Files are by end month, so only those from start's month on can hold one, and
+    of those only the ones whose earliest event starts before `end`.
+    """
+    ids = set(camera_ids) if camera_ids is not None else None
+    index = _load_index() if end else None
+    for month in months("downtimeevent", month_of(start) if start else None):
+        if end and _earliest(index, "downtimeevent", month, "start_time") >= end: continue
+        for row in read("downtimeevent", month, month):
+            if end and row["start_time"] >= end: continue
+            if start and row["end_time"] <= start: continue
+            if ids is not None and row["camera_id"] not in ids: continue
+            yield row
+
+def downtime_minutes(start, end, camera_ids=None):
+    """{camera_id: minutes} of archived downtime inside [start, end)."""
+    acc = defaultdict(float)
+    for row in downtime_events(start, end, camera_ids):
+        acc[row["camera_id"]] += (min(row["end_time"], end) - max(row["start_time"], start)).total_seconds() / 60
+    return acc
@@ -0,0 +1,111 @@
+import asyncio
+import os
+import orjson
+from sqlmodel import Session, select
+from database import read_engine, Camera
+from camera_index import camera_index
+
+CAMERA_FIELDS = list(Camera.model_fields)
+
+def camera_json(cam):
+    # Plain dict for orjson; skips a pydantic dump per camera
+    return {k: getattr(cam, k) for k in CAMERA_FIELDS}
+
+class Subscriber:
+    def __init__(self):
+        self.queue = asyncio.Queue(maxsize=100)
+        self.resync = False
+
+class CameraHub:
+    """Fans camera state changes out to dashboard streams.
+
+    `version` goes up on every publish; /api/cameras uses it as its ETag and
+    caches the serialized list per version.
+    """
+
+    def __init__(self):
+        self.boot = os.urandom(4).hex()
+        self.version = 0
+        self.subscribers = set()
+        self.loop = None
+        self._cached = (None, None)
+
+    @property
+    def etag(self):
+        return f'"{self.boot}-{self.version}"'
+
+    def snapshot(self):
+        """Serialized full camera list for the current version, in /api/cameras order.
+
+        Until the monitor has loaded the index it is read from the database (blocking; see `snapshot_async`).
+        """
+        if not camera_index.loaded:
+            with Session(read_engine) as session:
+                return orjson.dumps([camera_json(c) for c in session.exec(select(Camera).order_by(Camera.nvr_ip, Camera.channel_id)).all()])
+        version, body = self._cached
+        if version != self.version or body is None:
+            cams = sorted(camera_index.all(), key=lambda c: (c.nvr_ip, c.channel_id))
+            body = orjson.dumps([camera_json(c) for c in cams])
+            self._cached = (self.version, body)
+        return body
+
+    async def snapshot_async(self):
+        return self.snapshot() if camera_index.loaded else await asyncio.to_thread(self.snapshot)
+
+    def publish(self, camera_ids):
+        if not camera_ids: return
+        try: running = asyncio.get_running_loop()
+        except RuntimeError: running = None
+        if running and not self.loop: self.loop = running
+        if self.loop and running is not self.loop:
+            self.loop.call_soon_threadsafe(self._publish, list(camera_ids))
+        else: self._publish(list(camera_ids))
+
+    def _publish(self, camera_ids):
+        self.version += 1
+        cams = [camera_json(camera_index.by_id[cid]) for cid in camera_ids if cid in camera_index.by_id]
+        if not cams or not self.subscribers: return
+        msg = {"version": self.version, "cameras": cams}
+        for sub in self.subscribers:
+            try: sub.queue.put_nowait(msg)
+            except asyncio.QueueFull: sub.resync = True
+
+    def resync_all(self):
+        # The index was (re)loaded: every stream starts over from a snapshot
+        self.version += 1
+        for sub in self.subscribers: sub.resync = True
+        for sub in self.subscribers:
+            try: sub.queue.put_nowait(None)
+            except asyncio.QueueFull: pass
+
+    def subscribe(self):
+        self.loop = asyncio.get_running_loop()
+        sub = Subscriber()
+        self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        self.subscribers.discard(sub)
+
+    async def stream(self, is_disconnected, keepalive=15):
+        """SSE frames: one `snapshot`, then `delta` events with only the changed cameras."""
+        sub = self.subscribe()
+        async def snapshot_frame():
+            while not sub.queue.empty(): sub.queue.get_nowait()
+            sub.resync = False
+            version, body = self.version, await self.snapshot_async()
+            return f"event: snapshot\nid: {version}\ndata: {{\"version\": {version}, \"cameras\": {body.decode()}}}\n\n"
+        try:
+            yield "retry: 3000\n\n" + await snapshot_frame()
+            while not await is_disconnected():
+                if sub.resync:
+                    yield await snapshot_frame(); continue
+                try: msg = await asyncio.wait_for(sub.queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"; continue
+                if msg is None: continue
+                yield f"event: delta\nid: {msg['version']}\ndata: {orjson.dumps(msg).decode()}\n\n"
+        finally:
+            self.unsubscribe(sub)
+
+camera_hub = CameraHub()
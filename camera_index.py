@@ -0,0 +1,121 @@
+from datetime import timedelta
+from sqlmodel import Session, select, update
+from database import read_engine, Camera
+
+# last_online of an Online camera moves every poll; only checkpoint it this often
+LAST_ONLINE_CHECKPOINT = timedelta(minutes=5)
+
+class CameraIndex:
+    """Resident copy of the Camera table keyed by (nvr_ip, channel_id).
+
+    Cameras are detached from any session. Changes go through set()/touch_online()
+    so that flush() can write only the changed columns in one bulk UPDATE.
+    """
+
+    def __init__(self):
+        self.by_key = {}
+        self.by_id = {}
+        self.dirty = {}
+        self.saved_last_online = {}
+        self.loaded = False
+
+    def load(self, nvr_ips=None):
+        """Loads every camera, or only those behind `nvr_ips` (a shard worker's NVRs)."""
+        stmt = select(Camera)
+        if nvr_ips is not None: stmt = stmt.where(Camera.nvr_ip.in_(nvr_ips))
+        with Session(read_engine) as session:
+            cams = session.exec(stmt).all()
+            session.expunge_all()
+        self.by_key.clear(); self.by_id.clear(); self.dirty.clear(); self.saved_last_online.clear()
+        for cam in cams: self._put(cam)
+        self.loaded = True
+
+    def invalidate(self):
+        self.loaded = False
+
+    def _put(self, cam):
+        self.by_key[(cam.nvr_ip, cam.channel_id)] = cam
+        self.by_id[cam.id] = cam
+        self.saved_last_online[cam.id] = cam.last_online
+
+    def get(self, nvr_ip, channel_id):
+        return self.by_key.get((nvr_ip, channel_id))
+
+    def all(self):
+        return list(self.by_id.values())
+
+    def set(self, cam, **fields):
+        changed = False
+        for k, v in fields.items():
+            if getattr(cam, k) != v:
+                setattr(cam, k, v)
+                self.dirty.setdefault(cam.id, {})[k] = v
+                changed = True
+        return changed
+
+    def touch_online(self, cam, now):
+        cam.last_online = now
+        saved = self.saved_last_online.get(cam.id)
+        if saved is None or now - saved >= LAST_ONLINE_CHECKPOINT:
+            self.dirty.setdefault(cam.id, {})["last_online"] = now
+
+    def mark_last_online(self, cam):
+        # Persist the in-memory value, e.g. when the camera just went offline
+        self.dirty.setdefault(cam.id, {})["last_online"] = cam.last_online
+
+    def read_rows(self):
+        with read_engine.connect() as conn:
+            return conn.execute(select(Camera.__table__)).mappings().all()
+
+    def refresh(self, rows):
+        """Coordinator mode: adopt what shard workers wrote. Returns ids of cameras that changed."""
+        changed = []
+        seen = set()
+        for row in rows:
+            seen.add(row["id"])
+            cam = self.by_id.get(row["id"])
+            if cam is None:
+                self._put(Camera(**row))
+                changed.append(row["id"])
+                continue
+            diff = False
+            for k, v in row.items():
+                if getattr(cam, k) != v:
+                    setattr(cam, k, v)
+                    diff = True
+            if diff: changed.append(cam.id)
+        for cid in [cid for cid in self.by_id if cid not in seen]:
+            cam = self.by_id.pop(cid)
+            self.by_key.pop((cam.nvr_ip, cam.channel_id), None)
+        self.saved_last_online.update({cid: self.by_id[cid].last_online for cid in changed if cid in self.by_id})
+        return changed
+
+    def apply_external(self, cam):
+        """Sync a row that was changed outside the monitor (API edits)."""
+        mem = self.by_id.get(cam.id)
+        if mem is None: return
+        for k in ("name", "importance", "is_muted"):
+            setattr(mem, k, getattr(cam, k))
+
+    def insert(self, session, cams):
+        """Insert brand-new cameras with a single flush so they get ids."""
+        if not cams: return
+        session.add_all(cams)
+        session.flush()
+        for cam in cams:
+            session.expunge(cam)
+            self._put(cam)
+
+    def flush(self, session):
+        """Queue the pending column changes as one bulk UPDATE by primary key."""
+        if not self.dirty: return 0
+        rows = [{"id": cid, **fields} for cid, fields in self.dirty.items()]
+        session.execute(update(Camera), rows)
+        return len(rows)
+
+    def committed(self):
+        for cid, fields in self.dirty.items():
+            if "last_online" in fields: self.saved_last_online[cid] = fields["last_online"]
+        self.dirty.clear()
+
+camera_index = CameraIndex()
@@ -0,0 +1,54 @@
+import csv
+import os
+import threading
+from collections import namedtuple
+
+CameraMeta = namedtuple("CameraMeta", "name importance")
+
+class CameraMetaIndex:
+    """ip -> CameraMeta parsed from camera_names.csv.
+
+    The file is re-parsed only when its mtime/size change or reload() is called.
+    `version` goes up on every reload so callers can tell when to re-apply it.
+    """
+
+    def __init__(self, path="camera_names.csv"):
+        self.path = path
+        self.stamp = None
+        self.meta = {}
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def get(self):
+        if self._stat() != self.stamp: self.reload()
+        return self.meta
+
+    def reload(self):
+        with self.lock:
+            stamp = self._stat()
+            meta = {}
+            if stamp:
+                try:
+                    with open(self.path, "r", encoding="utf-8-sig") as f:
+                        reader = csv.reader(f)
+                        next(reader, None)
+                        for row in reader:
+                            if len(row) >= 2 and row[0].strip():
+                                imp = None
+                                if len(row) >= 3 and row[2].strip() in ("1", "2", "3"): imp = int(row[2].strip())
+                                meta[row[0].strip()] = CameraMeta(row[1].strip(), imp)
+                except Exception as e:
+                    print(f"CSV Error: {e}")
+            self.meta = meta
+            self.stamp = stamp
+            self.version += 1
+        return meta
+
+camera_meta = CameraMetaIndex()
@@ -0,0 +1,92 @@
+import threading
+from dataclasses import dataclass, field
+from sqlmodel import Session, select
+from database import read_engine, Settings
+
+def _int(raw, key, default):
+    try: return int(raw.get(key, default))
+    except (TypeError, ValueError): return default
+
+def _days(raw, key, default):
+    # 0 keeps rows forever; otherwise at least 8 days so the 7d stats stay in the hot tables
+    days = _int(raw, key, default)
+    return 0 if days <= 0 else max(8, days)
+
+@dataclass(frozen=True)
+class Config:
+    """Typed, immutable view of the Settings table."""
+    version: int = 0
+    raw: dict = field(default_factory=dict)
+
+    mail_enabled: bool = False
+    mail_delay: int = 1
+    mail_low_delay: int = 30
+    mail_freq: int = 60
+    mail_mute: int = 3
+
+    tele_enabled: bool = False
+    tele_delay: int = 1
+    tele_low_delay: int = 15
+    tele_freq: int = 30
+    tele_mute: int = 3
+
+    poll_concurrency: int = 32
+    poll_interval: int = 60
+    poll_events: bool = False
+    poll_reconcile: int = 600
+
+    flap_confirm: int = 2
+    flap_window: int = 15
+    flap_threshold: int = 6
+    flap_merge: int = 120
+
+    log_retention: int = 90
+    downtime_retention: int = 365
+
+    @classmethod
+    def from_raw(cls, raw, version):
+        return cls(
+            version=version,
+            raw=raw,
+            mail_enabled=raw.get("MAIL_ENABLED") == "true",
+            mail_delay=_int(raw, "MAIL_FIRST_ALERT_DELAY_MINUTES", 1),
+            mail_low_delay=_int(raw, "MAIL_LOW_IMPORTANCE_DELAY_MINUTES", 30),
+            mail_freq=_int(raw, "MAIL_ALERT_FREQUENCY_MINUTES", 60),
+            mail_mute=_int(raw, "MAIL_MUTE_AFTER_N_ALERTS", 3),
+            tele_enabled=raw.get("TELEGRAM_ENABLED") == "true",
+            tele_delay=_int(raw, "TELEGRAM_FIRST_ALERT_DELAY_MINUTES", 1),
+            tele_low_delay=_int(raw, "TELEGRAM_LOW_IMPORTANCE_DELAY_MINUTES", 15),
+            tele_freq=_int(raw, "TELEGRAM_ALERT_FREQUENCY_MINUTES", 30),
+            tele_mute=_int(raw, "TELEGRAM_MUTE_AFTER_N_ALERTS", 3),
+            poll_concurrency=_int(raw, "POLL_CONCURRENCY", 32),
+            poll_interval=max(5, _int(raw, "POLL_INTERVAL_SECONDS", 60)),
+            poll_events=raw.get("POLL_EVENTS_ENABLED") == "true",
+            poll_reconcile=max(5, _int(raw, "POLL_RECONCILE_SECONDS", 600)),
+            flap_confirm=max(1, _int(raw, "FLAP_CONFIRM_POLLS", 2)),
+            flap_window=max(1, _int(raw, "FLAP_WINDOW_MINUTES", 15)),
+            flap_threshold=max(0, _int(raw, "FLAP_THRESHOLD", 6)),
+            flap_merge=max(0, _int(raw, "FLAP_MERGE_SECONDS", 120)),
+            log_retention=_days(raw, "LOG_RETENTION_DAYS", 90),
+            downtime_retention=_days(raw, "DOWNTIME_RETENTION_DAYS", 365),
+        )
+
+class SettingsCache:
+    """Holds the current Config. Readers never touch the DB; writers call reload()."""
+
+    def __init__(self):
+        self.snapshot = None
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def reload(self):
+        with Session(read_engine) as session:
+            raw = {s.key: s.value for s in session.exec(select(Settings)).all()}
+        with self.lock:
+            self.version += 1
+            self.snapshot = Config.from_raw(raw, self.version)
+        return self.snapshot
+
+    def get(self):
+        return self.snapshot or self.reload()
+
+settings_cache = SettingsCache()
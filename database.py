@@ -1,4 +1,7 @@
-from sqlmodel import SQLModel, Field, create_engine, Session
+import asyncio
+from contextlib import asynccontextmanager
+from sqlmodel import SQLModel, Field, create_engine, Session, Index, text
+from sqlalchemy import event
 from datetime import datetime
 from typing import Optional
 
@@ -7,6 +10,17 @@ class NVR(SQLModel, table=True):
     user: str
     password: Optional[str] = None
     enabled: bool = True
+    poll_interval: Optional[int] = None  # seconds; None uses POLL_INTERVAL_SECONDS
+
+class NVRLease(SQLModel, table=True):
+    """Which shard worker polls an NVR (MONITOR_WORKERS > 0). Expired leases are up for grabs."""
+    nvr_ip: str = Field(primary_key=True)
+    owner: str = Field(index=True)
+    expires: datetime
+
+class MonitorWorker(SQLModel, table=True):
+    id: str = Field(primary_key=True)
+    heartbeat: datetime
 
 class Camera(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -25,14 +39,39 @@ class Camera(SQLModel, table=True):
     telegram_last_alert: Optional[datetime] = None
 
 class DowntimeEvent(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_downtimeevent_camera_start", "camera_id", "start_time"),
+        Index("ix_downtimeevent_end_start", "end_time", "start_time", "camera_id"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     camera_id: int = Field(foreign_key="camera.id")
     start_time: datetime = Field(default_factory=datetime.now)
     end_time: Optional[datetime] = None
 
+class DowntimeHourly(SQLModel, table=True):
+    __table_args__ = (Index("ix_downtimehourly_hour", "hour", "camera_id"),)
+    camera_id: int = Field(foreign_key="camera.id", primary_key=True)
+    hour: datetime = Field(primary_key=True)
+    minutes: float = 0
+
+class AlertOutbox(SQLModel, table=True):
+    __table_args__ = (Index("ix_alertoutbox_status_next", "status", "next_attempt"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    created_at: datetime = Field(default_factory=datetime.now)
+    channel: str  # "telegram" | "mail"
+    subject: str
+    body: str
+    targets: Optional[str] = None  # telegram chats still to deliver to; None means all
+    status: str = "pending"  # pending | sent | failed | cancelled
+    attempts: int = 0
+    next_attempt: datetime = Field(default_factory=datetime.now)
+    last_error: Optional[str] = None
+    sent_at: Optional[datetime] = None
+
 class Log(SQLModel, table=True):
+    __table_args__ = (Index("ix_log_type_timestamp", "log_type", "timestamp"),)
     id: Optional[int] = Field(default=None, primary_key=True)
-    timestamp: datetime = Field(default_factory=datetime.now)
+    timestamp: datetime = Field(default_factory=datetime.now, index=True)
     log_type: str
     state: str
     details: str
@@ -44,13 +83,115 @@ class Settings(SQLModel, table=True):
 
 sqlite_file_name = "data/monitor.db"
 sqlite_url = f"sqlite:///{sqlite_file_name}"
-engine = create_engine(sqlite_url, connect_args={"check_same_thread": False})
+
+# WAL lets API readers run while the monitor writes. All writes share one
+# pooled connection so they queue in-process instead of hitting SQLITE_BUSY.
+engine = create_engine(sqlite_url, connect_args={"check_same_thread": False, "timeout": 30}, pool_size=1, max_overflow=0, pool_timeout=60)
+read_engine = create_engine(f"sqlite:///file:{sqlite_file_name}?mode=ro&uri=true", connect_args={"check_same_thread": False, "timeout": 30}, pool_size=8, max_overflow=8)
+
+SQLITE_PRAGMAS = {
+    "synchronous": "NORMAL",   # safe with WAL, fsync only at checkpoints
+    "cache_size": "-32000",    # ~32MB page cache per connection
+    "temp_store": "MEMORY",
+    "mmap_size": "268435456",
+}
+
+@event.listens_for(engine, "connect")
+def _writer_pragmas(dbapi_conn, _):
+    cur = dbapi_conn.cursor()
+    # Takes effect only on a new database, and only before WAL writes its header;
+    # an existing one switches through tools/compact.py
+    cur.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    cur.execute("PRAGMA journal_mode=WAL")
+    for k, v in SQLITE_PRAGMAS.items(): cur.execute(f"PRAGMA {k}={v}")
+    cur.close()
+
+@event.listens_for(read_engine, "connect")
+def _reader_pragmas(dbapi_conn, _):
+    cur = dbapi_conn.cursor()
+    for k, v in SQLITE_PRAGMAS.items(): cur.execute(f"PRAGMA {k}={v}")
+    cur.execute("PRAGMA query_only=ON")
+    cur.close()
 
 def init_db():
     import os
     os.makedirs("data", exist_ok=True)
     SQLModel.metadata.create_all(engine)
+    migrate_columns()
+    # create_all skips indexes on tables that already exist
+    for table in SQLModel.metadata.sorted_tables:
+        for idx in table.indexes: idx.create(engine, checkfirst=True)
+    init_log_fts()
+
+def incremental_vacuum_enabled():
+    with engine.connect() as conn: return conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2
+
+def enable_incremental_vacuum():
+    """Lets retention hand freed pages back to the OS in small steps.
+
+    An existing database switches over with one full VACUUM: it rewrites the
+    whole file under the write lock and needs about its size in free disk.
+    Returns False if it already was incremental.
+    """
+    if incremental_vacuum_enabled(): return False
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+    return True
+
+# Columns added after the first release; create_all does not alter existing tables
+ADDED_COLUMNS = [
+    ("nvr", "poll_interval", "INTEGER"),
+]
+
+def migrate_columns():
+    with engine.begin() as conn:
+        for table, column, ddl in ADDED_COLUMNS:
+            cols = {r[1] for r in conn.execute(text(f"PRAGMA table_info({table})"))}
+            if column not in cols: conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+# Full-text index over Log, kept in sync by triggers. trigram keeps the old
+# substring ("contains") semantics, including for Persian text.
+LOG_FTS_DDL = [
+    "CREATE VIRTUAL TABLE log_fts USING fts5(details, log_type, content='log', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS log_fts_ai AFTER INSERT ON log BEGIN INSERT INTO log_fts(rowid, details, log_type) VALUES (new.id, new.details, new.log_type); END",
+    "CREATE TRIGGER IF NOT EXISTS log_fts_ad AFTER DELETE ON log BEGIN INSERT INTO log_fts(log_fts, rowid, details, log_type) VALUES ('delete', old.id, old.details, old.log_type); END",
+    "CREATE TRIGGER IF NOT EXISTS log_fts_au AFTER UPDATE ON log BEGIN INSERT INTO log_fts(log_fts, rowid, details, log_type) VALUES ('delete', old.id, old.details, old.log_type); INSERT INTO log_fts(rowid, details, log_type) VALUES (new.id, new.details, new.log_type); END",
+]
+log_fts_enabled = False
+
+def init_log_fts():
+    global log_fts_enabled
+    with engine.begin() as conn:
+        exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'log_fts'")).first()
+        try:
+            if not exists:
+                conn.execute(text(LOG_FTS_DDL[0]))
+                conn.execute(text("INSERT INTO log_fts(log_fts) VALUES ('rebuild')"))
+            for ddl in LOG_FTS_DDL[1:]: conn.execute(text(ddl))
+            log_fts_enabled = True
+        except Exception as e:
+            # SQLite built without FTS5/trigram: search falls back to LIKE
+            print(f"Log FTS disabled: {e}")
 
 def get_session():
-    with Session(engine) as session:
+    # Objects stay loaded after commit, so returning them does not check the writer out again
+    with Session(engine, expire_on_commit=False) as session:
+        yield session
+
+@asynccontextmanager
+async def write_session():
+    """Session on the writer connection for code on the event loop.
+
+    The connection is checked out in a thread: a sync API handler may hold it
+    until its dependency is torn down, which needs the loop to run.
+    """
+    conn = await asyncio.to_thread(engine.connect)
+    try:
+        with Session(bind=conn) as session: yield session
+    finally:
+        conn.close()
+
+def get_read_session():
+    with Session(read_engine) as session:
         yield session
\ No newline at end of file
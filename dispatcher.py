@@ -0,0 +1,212 @@
+import asyncio
+import smtplib
+import time
+from datetime import datetime, timedelta
+import aiohttp
+from sqlmodel import Session, select, update
+from database import engine, read_engine, AlertOutbox
+from alerts import build_email, telegram_chat_ids
+from config import settings_cache
+from logsink import log_sink
+import metrics
+
+MAX_ATTEMPTS = 8
+BATCH = 50
+TELEGRAM_CHAT_INTERVAL = 1.0   # Telegram allows ~1 msg/s per chat
+SMTP_IDLE_CLOSE = 120
+
+class PermanentError(RuntimeError):
+    """A rejection that retrying cannot fix, e.g. a Telegram 400 for bad Markdown."""
+
+def backoff(attempts):
+    return timedelta(seconds=min(30 * 2 ** (attempts - 1), 3600))
+
+class SMTPPool:
+    """Keeps one logged-in SMTP connection and reuses it while the config is unchanged."""
+
+    def __init__(self):
+        self.conn = None
+        self.key = None
+        self.last_used = 0
+
+    def _connect(self, conf):
+        self.close()
+        server, port = conf.get("MAIL_SERVER"), int(conf.get("MAIL_PORT", 587))
+        conn = smtplib.SMTP(server, port, timeout=20)
+        conn.starttls()
+        conn.login(conf.get("MAIL_USER"), conf.get("MAIL_PASS"))
+        self.conn = conn
+        self.key = (server, port, conf.get("MAIL_USER"), conf.get("MAIL_PASS"))
+
+    def send(self, conf, subject, body):
+        key = (conf.get("MAIL_SERVER"), int(conf.get("MAIL_PORT", 587)), conf.get("MAIL_USER"), conf.get("MAIL_PASS"))
+        if self.conn is None or self.key != key: self._connect(conf)
+        sender, recipients, msg = build_email(conf, subject, body)
+        try:
+            self.conn.sendmail(sender, recipients, msg.as_string())
+        except smtplib.SMTPServerDisconnected:
+            self._connect(conf)
+            self.conn.sendmail(sender, recipients, msg.as_string())
+        self.last_used = time.monotonic()
+
+    def close_if_idle(self):
+        if self.conn and time.monotonic() - self.last_used > SMTP_IDLE_CLOSE: self.close()
+
+    def close(self):
+        if self.conn:
+            try: self.conn.quit()
+            except Exception: pass
+        self.conn = None
+
+class TelegramClient:
+    """One reused HTTP session; chats are sent to concurrently, each rate limited."""
+
+    def __init__(self):
+        self.session = None
+        self.chat_next = {}
+
+    def _session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        return self.session
+
+    async def _send_chat(self, url, proxy, cid, message):
+        wait = self.chat_next.get(cid, 0) - time.monotonic()
+        if wait > 0: await asyncio.sleep(wait)
+        self.chat_next[cid] = time.monotonic() + TELEGRAM_CHAT_INTERVAL
+        payload = {'chat_id': cid, 'text': message, 'parse_mode': 'Markdown'}
+        async with self._session().post(url, data=payload, proxy=proxy or None) as resp:
+            if resp.status == 429:
+                retry = (await resp.json(content_type=None)).get("parameters", {}).get("retry_after", 5)
+                self.chat_next[cid] = time.monotonic() + retry
+                raise RuntimeError(f"Rate limited for {retry}s")
+            if 400 <= resp.status < 500: raise PermanentError(f"HTTP {resp.status}: {(await resp.text())[:200]}")
+            if resp.status >= 300: raise RuntimeError(f"HTTP {resp.status}: {(await resp.text())[:200]}")
+
+    async def send(self, conf, message, chat_ids):
+        """Returns the chat ids that failed, with their exception."""
+        token = conf.get("TELEGRAM_BOT_TOKEN")
+        if not token or not chat_ids: raise RuntimeError("Missing Token/ID")
+        url = f"https://api.telegram.org/bot{token}/sendMessage"
+        proxy = conf.get("TELEGRAM_PROXY", "")
+        results = await asyncio.gather(*[self._send_chat(url, proxy, cid, message) for cid in chat_ids], return_exceptions=True)
+        return {cid: r for cid, r in zip(chat_ids, results) if isinstance(r, Exception)}
+
+    async def close(self):
+        if self.session and not self.session.closed: await self.session.close()
+
+class AlertDispatcher:
+    """Drains AlertOutbox in the background with retries and exponential backoff."""
+
+    def __init__(self, poll_interval=10):
+        self.poll_interval = poll_interval
+        self.smtp = SMTPPool()
+        self.telegram = TelegramClient()
+        self.task = None
+        self.wakeup = None
+
+    def start(self):
+        if self.task and not self.task.done(): return
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+
+    def notify(self):
+        if self.wakeup: self.wakeup.set()
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try: await self.task
+            except asyncio.CancelledError: pass
+            self.task = None
+        await self.telegram.close()
+        await asyncio.to_thread(self.smtp.close)
+
+    async def _run(self):
+        while True:
+            try:
+                while await self.drain() == BATCH: pass
+                await asyncio.to_thread(self.smtp.close_if_idle)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Dispatcher Error: {e}")
+            try: await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError: pass
+            self.wakeup.clear()
+
+    def _due(self):
+        with Session(read_engine) as session:
+            rows = session.exec(select(AlertOutbox).where(AlertOutbox.status == "pending", AlertOutbox.next_attempt <= datetime.now())
+                                .order_by(AlertOutbox.id).limit(BATCH)).all()
+            session.expunge_all()
+        return rows
+
+    def _save(self, results):
+        with Session(engine) as session:
+            for row_id, values in results: session.execute(update(AlertOutbox).where(AlertOutbox.id == row_id).values(**values))
+            session.commit()
+
+    async def drain(self):
+        rows = await asyncio.to_thread(self._due)
+        if not rows: return 0
+        conf = settings_cache.get()
+        mail = [r for r in rows if r.channel == "mail"]
+        tele = [r for r in rows if r.channel == "telegram"]
+        results = []
+        await asyncio.gather(self._send_mail(conf, mail, results), self._send_telegram(conf, tele, results))
+        await asyncio.to_thread(self._save, results)
+        return len(rows)
+
+    def _outcome(self, row, error, permanent=False, **extra):
+        now = datetime.now()
+        attempts = row.attempts + 1
+        if error is None:
+            metrics.alert_sends.labels(row.channel, "sent").inc()
+            metrics.alert_delay_seconds.labels(row.channel).observe((now - row.created_at).total_seconds())
+            return (row.id, {"status": "sent", "sent_at": now, "attempts": attempts, "last_error": None})
+        if permanent or attempts >= MAX_ATTEMPTS:
+            metrics.alert_sends.labels(row.channel, "failed").inc()
+            log_sink.put("Mail" if row.channel == "mail" else "Telegram", "Failed", f"{'Rejected' if permanent else 'Gave up on'} '{row.subject}': {error}")
+            return (row.id, {"status": "failed", "attempts": attempts, "last_error": error, **extra})
+        metrics.alert_sends.labels(row.channel, "retry").inc()
+        return (row.id, {"attempts": attempts, "last_error": error, "next_attempt": now + backoff(attempts), **extra})
+
+    async def _send_mail(self, conf, rows, results):
+        for row in rows:
+            if not conf.mail_enabled:
+                results.append((row.id, {"status": "cancelled"})); continue
+            try:
+                with metrics.timed(metrics.alert_send_seconds.labels("mail")):
+                    await asyncio.to_thread(self.smtp.send, conf.raw, row.subject, row.body)
+                log_sink.put("Mail", "Sent", row.subject)
+                results.append(self._outcome(row, None))
+            except Exception as e:
+                print(f"📧 Mail Error: {e}")
+                await asyncio.to_thread(self.smtp.close)
+                results.append(self._outcome(row, str(e)))
+
+    async def _send_telegram(self, conf, rows, results):
+        for row in rows:
+            if not conf.tele_enabled:
+                results.append((row.id, {"status": "cancelled"})); continue
+            chat_ids = row.targets.split(",") if row.targets else telegram_chat_ids(conf.raw)
+            try:
+                with metrics.timed(metrics.alert_send_seconds.labels("telegram")):
+                    failed = await self.telegram.send(conf.raw, row.body, chat_ids)
+            except Exception as e:
+                print(f"✈️ Telegram Error: {e}")
+                results.append(self._outcome(row, str(e))); continue
+            if failed:
+                # Only the chats that failed are retried; a 4xx (bad chat id, unparsable Markdown) never will succeed
+                error = "; ".join(f"{cid}: {str(err) or type(err).__name__}" for cid, err in failed.items())
+                print(f"✈️ Telegram Error: {error}")
+                retry = [cid for cid, err in failed.items() if not isinstance(err, PermanentError)]
+                if retry and len(retry) < len(failed):
+                    log_sink.put("Telegram", "Failed", f"Rejected '{row.subject}' for chats {','.join(c for c in failed if c not in retry)}")
+                results.append(self._outcome(row, error, permanent=not retry, targets=",".join(retry or failed)))
+            else:
+                log_sink.put("Telegram", "Sent", row.subject)
+                results.append(self._outcome(row, None))
+
+alert_dispatcher = AlertDispatcher()
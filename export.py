@@ -0,0 +1,128 @@
+import csv
+import io
+import itertools
+import json
+from datetime import datetime
+from sqlalchemy import or_, select
+from sqlmodel import Session
+from database import read_engine, Camera, DowntimeEvent, Log
+from reports import range_minutes
+import archive
+
+CHUNK = 1000
+FORMATS = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+def _value(v):
+    return v.isoformat(sep=" ") if isinstance(v, datetime) else v
+
+def stream_rows(stmt):
+    """Yields result rows as dicts from a streaming cursor, CHUNK at a time."""
+    with read_engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=CHUNK).execute(stmt)
+        for part in result.mappings().partitions():
+            yield from part
+
+def encode(rows, columns, fmt):
+    """Serializes dict rows into CSV or NDJSON text chunks."""
+    if fmt == "ndjson":
+        batch = []
+        for row in rows:
+            batch.append(json.dumps({c: _value(row[c]) for c in columns}, ensure_ascii=False))
+            if len(batch) >= CHUNK:
+                yield "\n".join(batch) + "\n"
+                batch = []
+        if batch: yield "\n".join(batch) + "\n"
+        return
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    # BOM so Excel opens Persian names correctly
+    writer.writerow(columns)
+    yield "﻿" + buf.getvalue()
+    buf.seek(0); buf.truncate()
+    n = 0
+    for row in rows:
+        writer.writerow([_value(row[c]) for c in columns])
+        n += 1
+        if n % CHUNK == 0:
+            yield buf.getvalue()
+            buf.seek(0); buf.truncate()
+    if buf.tell(): yield buf.getvalue()
+
+# --- EXPORTS ---
+# Each returns (columns, row generator). Filters: start/end datetimes, nvr_ip, camera_id.
+# Rows past retention come from the monthly archive files first, then the live tables.
+
+def _camera_info(nvr_ip=None, camera_id=None):
+    stmt = select(Camera.id, Camera.name, Camera.ip, Camera.nvr_ip)
+    if nvr_ip: stmt = stmt.where(Camera.nvr_ip == nvr_ip)
+    if camera_id is not None: stmt = stmt.where(Camera.id == camera_id)
+    with read_engine.connect() as conn: return {r.id: r for r in conn.execute(stmt)}
+
+DOWNTIME_COLUMNS = ["event_id", "camera_id", "camera_name", "camera_ip", "nvr_ip", "start_time", "end_time", "minutes"]
+
+def downtime_events(start=None, end=None, nvr_ip=None, camera_id=None):
+    """Raw DowntimeEvent rows overlapping the range (open events included), oldest first."""
+    stmt = (select(DowntimeEvent.id.label("event_id"), DowntimeEvent.camera_id, Camera.name.label("camera_name"), Camera.ip.label("camera_ip"),
+                   Camera.nvr_ip, DowntimeEvent.start_time, DowntimeEvent.end_time)
+            .join(Camera, Camera.id == DowntimeEvent.camera_id)
+            .order_by(DowntimeEvent.start_time, DowntimeEvent.id))
+    if end: stmt = stmt.where(DowntimeEvent.start_time < end)
+    if start: stmt = stmt.where(or_(DowntimeEvent.end_time == None, DowntimeEvent.end_time > start))
+    if nvr_ip: stmt = stmt.where(Camera.nvr_ip == nvr_ip)
+    if camera_id is not None: stmt = stmt.where(DowntimeEvent.camera_id == camera_id)
+    def archived():
+        if not archive.months("downtimeevent", archive.month_of(start) if start else None): return
+        cams = _camera_info(nvr_ip, camera_id)
+        for row in archive.downtime_events(start, end, list(cams)):
+            cam = cams[row["camera_id"]]
+            yield {"event_id": row["id"], "camera_id": cam.id, "camera_name": cam.name, "camera_ip": cam.ip, "nvr_ip": cam.nvr_ip,
+                   "start_time": row["start_time"], "end_time": row["end_time"]}
+    def rows():
+        now = datetime.now()
+        for row in itertools.chain(archived(), stream_rows(stmt)):
+            row = dict(row)
+            row["minutes"] = round(((row["end_time"] or now) - row["start_time"]).total_seconds() / 60, 1)
+            yield row
+    return DOWNTIME_COLUMNS, rows()
+
+LOG_COLUMNS = ["id", "timestamp", "log_type", "state", "details"]
+
+def logs(start=None, end=None, nvr_ip=None, camera_id=None, log_type=None):
+    """Log rows oldest first. Camera/NVR filters match the "name (ip)" and "NVR ip" texts the monitor logs."""
+    stmt = select(Log.id, Log.timestamp, Log.log_type, Log.state, Log.details).order_by(Log.timestamp, Log.id)
+    if start: stmt = stmt.where(Log.timestamp >= start)
+    if end: stmt = stmt.where(Log.timestamp < end)
+    if log_type: stmt = stmt.where(Log.log_type == log_type)
+    suffixes = prefix = None
+    if nvr_ip or camera_id is not None:
+        ips = sorted({c.ip for c in _camera_info(nvr_ip, camera_id).values()})
+        suffixes = tuple(f"({ip})" for ip in ips)
+        if nvr_ip and camera_id is None: prefix = f"NVR {nvr_ip} "
+        patterns = [Log.details.like(f"%{s}") for s in suffixes] + ([Log.details.like(f"{prefix}%")] if prefix else [])
+        stmt = stmt.where(or_(*patterns)) if patterns else stmt.where(False)
+    def archived():
+        for row in archive.read("log", archive.month_of(start) if start else None, archive.month_of(end) if end else None):
+            if start and row["timestamp"] < start: continue
+            if end and row["timestamp"] >= end: continue
+            if log_type and row["log_type"] != log_type: continue
+            if suffixes is not None and not (row["details"].endswith(suffixes) or (prefix and row["details"].startswith(prefix))): continue
+            yield row
+    return LOG_COLUMNS, itertools.chain(archived(), stream_rows(stmt))
+
+UPTIME_COLUMNS = ["camera_id", "camera_name", "camera_ip", "nvr_ip", "status", "downtime_minutes", "uptime_percent"]
+
+def uptime(start, end, nvr_ip=None, camera_id=None):
+    """One row per camera with its downtime and uptime % over [start, end)."""
+    stmt = select(Camera.id.label("camera_id"), Camera.name.label("camera_name"), Camera.ip.label("camera_ip"), Camera.nvr_ip, Camera.status).order_by(Camera.nvr_ip, Camera.channel_id)
+    if nvr_ip: stmt = stmt.where(Camera.nvr_ip == nvr_ip)
+    if camera_id is not None: stmt = stmt.where(Camera.id == camera_id)
+    total = max((end - start).total_seconds() / 60, 1e-9)
+    def rows():
+        with Session(read_engine) as session:
+            down = range_minutes(session, start, end, [camera_id] if camera_id is not None else None)
+        for row in stream_rows(stmt):
+            row = dict(row)
+            row["downtime_minutes"] = down.get(row["camera_id"], 0)
+            row["uptime_percent"] = round(max(0.0, 100 - row["downtime_minutes"] / total * 100), 3)
+            yield row
+    return UPTIME_COLUMNS, rows()
@@ -0,0 +1,81 @@
+from collections import deque
+from datetime import timedelta
+from sqlmodel import Session, select
+from database import read_engine, DowntimeEvent
+
+class FlapState:
+    __slots__ = ("down", "count", "since", "flips", "flapping", "closed_at")
+
+    def __init__(self, down, flapping=False, now=None):
+        self.down = down
+        self.count = 0              # observations in a row that disagree with `down`
+        self.since = None           # when the first of them was seen
+        self.flips = deque([now] if flapping else [])
+        self.flapping = flapping
+        self.closed_at = None       # end of the last outage, for merging
+
+class FlapDamper:
+    """Hysteresis and flap detection between raw observations and camera status.
+
+    A camera's up/down state changes only after `flap_confirm` identical
+    observations in a row, and the change is dated to the first of them. After
+    `flap_threshold` changes inside `flap_window` the camera's status becomes
+    "Flapping" and stays so, without per-flip logs or alerts, until a whole
+    window passes without a change. Up/down is still tracked underneath for
+    downtime; an outage starting within `flap_merge` of the previous one's end
+    continues that outage.
+    """
+
+    def __init__(self):
+        self.state = {}
+        self.open_ids = set()
+
+    def load(self, cams):
+        """Forgets all state. Flapping cameras are down if they have an open event."""
+        self.state.clear()
+        ids = [c.id for c in cams if c.status == "Flapping"]
+        if not ids: self.open_ids = set(); return
+        with Session(read_engine) as session:
+            self.open_ids = set(session.exec(select(DowntimeEvent.camera_id).where(
+                DowntimeEvent.camera_id.in_(ids), DowntimeEvent.end_time == None)).all())
+
+    def _get(self, cam, now):
+        s = self.state.get(cam.id)
+        if s is None:
+            flapping = cam.status == "Flapping"
+            s = self.state[cam.id] = FlapState(cam.status == "Offline" or (flapping and cam.id in self.open_ids), flapping, now)
+        return s
+
+    def status(self, cam_id):
+        s = self.state[cam_id]
+        return "Flapping" if s.flapping else "Offline" if s.down else "Online"
+
+    def observe(self, cam, online, now, cfg, confirm=None):
+        """Feeds one observation. Returns (edge, pending).
+
+        edge is None or (new status, when, end of the outage it continues or None);
+        pending is True while a change is seen but not yet confirmed.
+        """
+        s = self._get(cam, now)
+        window = timedelta(minutes=cfg.flap_window)
+        edge = None
+        if online == s.down:
+            if s.count == 0: s.since = now
+            s.count += 1
+            if s.count >= (confirm or cfg.flap_confirm):
+                s.down, s.count = not online, 0
+                s.flips.append(s.since)
+                if online:
+                    edge = ("Online", s.since, None)
+                    s.closed_at = s.since
+                else:
+                    merge = s.closed_at is not None and s.since - s.closed_at <= timedelta(seconds=cfg.flap_merge)
+                    edge = ("Offline", s.since, s.closed_at if merge else None)
+        else:
+            s.count = 0
+        while s.flips and s.flips[0] < now - window: s.flips.popleft()
+        if cfg.flap_threshold and len(s.flips) >= cfg.flap_threshold: s.flapping = True
+        elif s.flapping and not s.flips and s.count == 0: s.flapping = False
+        return edge, s.count > 0
+
+flap_damper = FlapDamper()
@@ -0,0 +1,78 @@
+import asyncio
+import collections
+from datetime import datetime
+from sqlmodel import Session, insert
+from database import engine, Log
+import metrics
+
+class LogSink:
+    """Buffers Log rows in memory and writes them in batches.
+
+    A batch is flushed when `batch_size` rows are pending, every `flush_interval`
+    seconds, and on stop(). The write itself runs in a worker thread. While
+    writes fail, at most `max_pending` rows are kept; the oldest are dropped
+    and counted in hik_logs_dropped_total.
+    """
+
+    def __init__(self, batch_size=200, flush_interval=2.0, max_pending=50000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = collections.deque(maxlen=max_pending)
+        self.dropped = 0    # since the last successful flush
+        self.task = None
+        self.wakeup = None
+        self.loop = None
+
+    def put(self, l_type, state, details):
+        if len(self.pending) == self.pending.maxlen: self._drop(1)
+        self.pending.append({"timestamp": datetime.now(), "log_type": l_type, "state": state, "details": details})
+        if len(self.pending) >= self.batch_size and self.wakeup is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def start(self):
+        if self.task and not self.task.done(): return
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try: await self.task
+            except asyncio.CancelledError: pass
+            self.task = None
+        self.wakeup = None
+        await asyncio.to_thread(self.flush)
+
+    async def _run(self):
+        while True:
+            try: await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError: pass
+            self.wakeup.clear()
+            await asyncio.to_thread(self.flush)
+
+    def _drop(self, n):
+        if not self.dropped: print(f"Log buffer full ({self.pending.maxlen} rows), dropping the oldest logs")
+        self.dropped += n
+        metrics.logs_dropped.inc(n)
+
+    def flush(self):
+        rows = []
+        while self.pending: rows.append(self.pending.popleft())
+        if not rows: return 0
+        try:
+            with Session(engine) as session:
+                session.execute(insert(Log), rows)
+                session.commit()
+        except Exception as e:
+            print(f"Log flush error: {e}")
+            # Back in front of anything put meanwhile, as far as there is room; the oldest go first
+            room = self.pending.maxlen - len(self.pending)
+            if len(rows) > room: self._drop(len(rows) - room)
+            if room: self.pending.extendleft(reversed(rows[-room:]))
+            return 0
+        if self.dropped: print(f"Log writes resumed, {self.dropped} logs were dropped")
+        self.dropped = 0
+        return len(rows)
+
+log_sink = LogSink()
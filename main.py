@@ -1,22 +1,47 @@
 import asyncio
 import os
 import jdatetime
+import orjson
+import database
 from datetime import datetime, timedelta
+from functools import lru_cache
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Response, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, PlainTextResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from sqlmodel import Session, select, col
-from database import init_db, get_session, Camera, Log, NVR, Settings, DowntimeEvent, engine, sqlite_file_name
-from monitor import start_monitor_loop
+from sqlalchemy import column, tuple_
+from sqlmodel import Session, select, col, text
+from database import init_db, get_session, get_read_session, Camera, Log, NVR, Settings, engine
+from monitor import start_monitor_loop, start_coordinator_loop
+from worker import worker_pool, worker_count
+from camera_index import camera_index
+from alert_schedule import alert_schedule
+from logsink import log_sink
+from dispatcher import alert_dispatcher
+from camera_events import camera_hub
 from alerts import send_email_raw, send_telegram_raw, get_config_dict
+from reports import downtime_report, window_minutes, bucket_minutes
+from rollup import ensure_rollup, BUCKET_FORMATS
+from config import settings_cache
+from camera_meta import camera_meta
+from retention import retention
+import export
+import metrics
 
 class CsvContent(BaseModel):
     content: str
 
 monitor_task = None
 
+def start_monitor():
+    # MONITOR_WORKERS > 0: NVRs are sharded across worker processes and this process coordinates
+    workers = worker_count()
+    if not workers: return asyncio.create_task(start_monitor_loop())
+    worker_pool.start(workers)
+    return asyncio.create_task(start_coordinator_loop())
+
 def seed_defaults():
     with Session(engine) as session:
         defaults = [
@@ -38,6 +63,16 @@ def seed_defaults():
             ("TELEGRAM_LOW_IMPORTANCE_DELAY_MINUTES", "15", "Low Imp. Delay"),
             ("TELEGRAM_ALERT_FREQUENCY_MINUTES", "30", "Frequency"),
             ("TELEGRAM_MUTE_AFTER_N_ALERTS", "3", "Mute After N"),
+            ("POLL_CONCURRENCY", "32", "Max NVRs polled at once"),
+            ("POLL_INTERVAL_SECONDS", "60", "Default seconds between polls of one NVR"),
+            ("POLL_EVENTS_ENABLED", "false", "Listen to NVR alertStream events"),
+            ("POLL_RECONCILE_SECONDS", "600", "Seconds between polls of an NVR with a live event stream"),
+            ("FLAP_CONFIRM_POLLS", "2", "Polls in a row needed to accept a camera state change"),
+            ("FLAP_WINDOW_MINUTES", "15", "Window for counting state changes towards Flapping"),
+            ("FLAP_THRESHOLD", "6", "State changes within the window that mark a camera Flapping (0 = off)"),
+            ("FLAP_MERGE_SECONDS", "120", "An outage starting this soon after the last one ended continues it"),
+            ("LOG_RETENTION_DAYS", "90", "Days of logs kept in the live database before archiving (0 = forever)"),
+            ("DOWNTIME_RETENTION_DAYS", "365", "Days of downtime events kept in the live database before archiving (0 = forever)"),
         ]
         for key, val, desc in defaults:
             if not session.get(Settings, key):
@@ -49,13 +84,22 @@ async def lifespan(app: FastAPI):
     global monitor_task
     init_db()
     seed_defaults()
-    monitor_task = asyncio.create_task(start_monitor_loop())
+    settings_cache.reload()
+    ensure_rollup()
+    monitor_task = start_monitor()
+    retention.start()
     yield
+    await retention.stop()
     if monitor_task: monitor_task.cancel()
     try: await monitor_task
     except: pass
+    await worker_pool.stop()
+    await alert_dispatcher.stop()
+    await log_sink.stop()
 
 app = FastAPI(lifespan=lifespan)
+# Camera lists and stats compress ~10x; SSE streams are left alone by the middleware
+app.add_middleware(GZipMiddleware, minimum_size=1000, compresslevel=5)
 
 # Serve Static Assets (CSS, JS)
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -65,6 +109,11 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 def read_root(): 
     return FileResponse('static/index.html')
 
+# Prometheus scrape endpoint
+@app.get("/metrics")
+async def get_metrics():
+    return Response(await metrics.render(), media_type=metrics.CONTENT_TYPE_LATEST)
+
 @app.post("/api/monitor/restart")
 async def restart_monitor():
     global monitor_task
@@ -72,7 +121,8 @@ async def restart_monitor():
         monitor_task.cancel()
         try: await monitor_task
         except: pass
-    monitor_task = asyncio.create_task(start_monitor_loop())
+    await worker_pool.stop()
+    monitor_task = start_monitor()
     return {"status": "restarted"}
 
 # --- TEST ENDPOINTS ---
@@ -92,7 +142,7 @@ def test_telegram():
 
 # --- API ---
 @app.get("/api/nvrs", response_model=list[NVR])
-def get_nvrs(session: Session = Depends(get_session)): return session.exec(select(NVR)).all()
+def get_nvrs(session: Session = Depends(get_read_session)): return session.exec(select(NVR)).all()
 
 @app.post("/api/nvrs")
 def create_nvr(nvr: NVR, session: Session = Depends(get_session)):
@@ -100,6 +150,16 @@ def create_nvr(nvr: NVR, session: Session = Depends(get_session)):
     session.commit()
     return nvr
 
+@app.put("/api/nvrs/{ip}")
+def update_nvr(ip: str, p: dict, session: Session = Depends(get_session)):
+    n = session.get(NVR, ip)
+    if not n: raise HTTPException(status_code=404, detail="NVR not found")
+    if "enabled" in p: n.enabled = bool(p["enabled"])
+    if "poll_interval" in p: n.poll_interval = max(5, int(p["poll_interval"])) if p["poll_interval"] else None
+    session.add(n)
+    session.commit()
+    return n
+
 @app.delete("/api/nvrs/{ip}")
 def delete_nvr(ip: str, session: Session = Depends(get_session)):
     session.delete(session.get(NVR, ip))
@@ -107,7 +167,17 @@ def delete_nvr(ip: str, session: Session = Depends(get_session)):
     return {"ok": True}
 
 @app.get("/api/cameras", response_model=list[Camera])
-def get_cameras(session: Session = Depends(get_session)): return session.exec(select(Camera).order_by(Camera.nvr_ip, Camera.channel_id)).all()
+async def get_cameras(request: Request):
+    # Served from the monitor's in-memory index; ETag changes only when a camera does
+    if not camera_index.loaded: return Response(await camera_hub.snapshot_async(), media_type="application/json")
+    headers = {"ETag": camera_hub.etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == camera_hub.etag: return Response(status_code=304, headers=headers)
+    return Response(camera_hub.snapshot(), media_type="application/json", headers=headers)
+
+@app.get("/api/cameras/stream")
+async def stream_cameras(request: Request):
+    return StreamingResponse(camera_hub.stream(request.is_disconnected), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.put("/api/cameras/{id}")
 def update_cam(id: int, p: dict, session: Session = Depends(get_session)):
@@ -115,10 +185,13 @@ def update_cam(id: int, p: dict, session: Session = Depends(get_session)):
     if "importance" in p: c.importance = int(p["importance"])
     session.add(c)
     session.commit()
+    camera_index.apply_external(c)
+    alert_schedule.touch(c.id)
+    camera_hub.publish([c.id])
     return c
 
 @app.get("/api/settings", response_model=list[Settings])
-def get_settings(session: Session = Depends(get_session)): return session.exec(select(Settings)).all()
+def get_settings(session: Session = Depends(get_read_session)): return session.exec(select(Settings)).all()
 
 @app.put("/api/settings/{key}")
 def update_setting(key: str, p: Settings, session: Session = Depends(get_session)):
@@ -126,6 +199,7 @@ def update_setting(key: str, p: Settings, session: Session = Depends(get_session
     s.value = p.value
     session.add(s)
     session.commit()
+    settings_cache.reload()
     return s
 
 @app.get("/api/config/csv", response_class=PlainTextResponse)
@@ -137,60 +211,95 @@ def get_csv():
 @app.post("/api/config/csv")
 def save_csv(payload: CsvContent):
     with open("camera_names.csv", "w", encoding="utf-8-sig") as f: f.write(payload.content)
+    camera_meta.reload()
     return {"ok": True}
 
+SHAMSI_MONTHS = {1:'فروردین',2:'اردیبهشت',3:'خرداد',4:'تیر',5:'مرداد',6:'شهریور',7:'مهر',8:'آبان',9:'آذر',10:'دی',11:'بهمن',12:'اسفند'}
+SHAMSI_DAYS = {'Sat':'شنبه','Sun':'یکشنبه','Mon':'دوشنبه','Tue':'سه‌شنبه','Wed':'چهارشنبه','Thu':'پنج‌شنبه','Fri':'جمعه'}
+
+@lru_cache(maxsize=4096)
+def _shamsi_minute(ts):
+    jd = jdatetime.datetime.fromgregorian(datetime=ts)
+    return f"{SHAMSI_DAYS[ts.strftime('%a')]} {jd.day} {SHAMSI_MONTHS[jd.month]} {jd.year} {jd.strftime('%H:%M')}"
+
+def shamsi_date(ts):
+    # Output has minute resolution, so cache per minute
+    return _shamsi_minute(ts.replace(second=0, microsecond=0))
+
+def log_cursor(l):
+    return f"{l.timestamp.isoformat()}|{l.id}"
+
 @app.get("/api/logs")
-def search_logs(q: str = None, limit: int = 50, offset: int = 0, session: Session = Depends(get_session)):
-    query = select(Log).order_by(Log.timestamp.desc()).offset(offset).limit(limit)
+def search_logs(response: Response, q: str = None, limit: int = 50, offset: int = 0, before: str = None, session: Session = Depends(get_read_session)):
+    """Newest first. Pass the X-Next-Cursor header of a page as `before` to get the next one."""
+    query = select(Log).order_by(Log.timestamp.desc(), Log.id.desc()).limit(limit)
+    if before:
+        try:
+            ts, log_id = before.rsplit("|", 1)
+            query = query.where(tuple_(Log.timestamp, Log.id) < tuple_(datetime.fromisoformat(ts), int(log_id)))
+        except ValueError: raise HTTPException(status_code=400, detail="Invalid cursor")
+    elif offset: query = query.offset(offset)
     if q: 
         if q in ['Camera','Telegram','Mail','Service']: query = query.where(col(Log.log_type) == q)
+        elif database.log_fts_enabled and len(q) >= 3:
+            matches = text("SELECT rowid FROM log_fts WHERE log_fts MATCH :fts_q").bindparams(fts_q='"' + q.replace('"', '""') + '"').columns(column("rowid"))
+            query = query.where(col(Log.id).in_(matches))
         else: query = query.where(col(Log.details).contains(q) | col(Log.log_type).contains(q))
     logs = session.exec(query).all()
     
     output = []
     for l in logs:
-        jd = jdatetime.datetime.fromgregorian(datetime=l.timestamp)
-        months = {1:'فروردین',2:'اردیبهشت',3:'خرداد',4:'تیر',5:'مرداد',6:'شهریور',7:'مهر',8:'آبان',9:'آذر',10:'دی',11:'بهمن',12:'اسفند'}
-        days = {'Sat':'شنبه','Sun':'یکشنبه','Mon':'دوشنبه','Tue':'سه‌شنبه','Wed':'چهارشنبه','Thu':'پنج‌شنبه','Fri':'جمعه'}
-        shamsi = f"{days[l.timestamp.strftime('%a')]} {jd.day} {months[jd.month]} {jd.year} {jd.strftime('%H:%M')}"
-        
         item = l.model_dump()
-        item['shamsi_date'] = shamsi
+        item['shamsi_date'] = shamsi_date(l.timestamp)
         output.append(item)
+    if len(logs) == limit: response.headers["X-Next-Cursor"] = log_cursor(logs[-1])
     return output
 
-def calculate_downtime_range(session, cam_id, start_ts, end_ts):
-    events = session.exec(select(DowntimeEvent).where(
-        DowntimeEvent.camera_id == cam_id,
-        DowntimeEvent.start_time < end_ts,
-        (DowntimeEvent.end_time == None) | (DowntimeEvent.end_time > start_ts)
-    )).all()
-    total_minutes = 0
-    now = datetime.now()
-    for e in events:
-        e_end = e.end_time or now
-        overlap_start = max(e.start_time, start_ts)
-        overlap_end = min(e_end, end_ts)
-        if overlap_end > overlap_start:
-            total_minutes += (overlap_end - overlap_start).total_seconds() / 60
-    return int(total_minutes)
+STATS_WINDOWS = {"1h": timedelta(hours=1), "24h": timedelta(hours=24), "7d": timedelta(days=7)}
+
+@app.get("/api/stats")
+def get_stats(ids: str = None, session: Session = Depends(get_read_session)):
+    """Downtime minutes per window for all cameras (or comma separated `ids`) as parallel arrays:
+    {"windows": {"1h": 60, ...}, "ids": [...], "down_1h": [...], ...}."""
+    try: cam_ids = [int(i) for i in ids.split(",") if i.strip()] if ids else None
+    except ValueError: raise HTTPException(status_code=400, detail="ids must be comma separated integers")
+    rows = window_minutes(session, datetime.now(), list(STATS_WINDOWS.values()), cam_ids)
+    body = {"windows": {k: int(v.total_seconds() // 60) for k, v in STATS_WINDOWS.items()}, "ids": [r[0] for r in rows]}
+    for i, key in enumerate(STATS_WINDOWS, 1): body[f"down_{key}"] = [int(r[i]) for r in rows]
+    return Response(orjson.dumps(body), media_type="application/json", headers={"Cache-Control": "private, max-age=30"})
 
 @app.get("/api/stats/{cam_id}")
-def get_cam_stats(cam_id: int, session: Session = Depends(get_session)):
-    now = datetime.now()
-    d1 = calculate_downtime_range(session, cam_id, now - timedelta(hours=1), now)
-    d24 = calculate_downtime_range(session, cam_id, now - timedelta(hours=24), now)
-    return {"down_1h": d1, "down_24h": d24}
+def get_cam_stats(cam_id: int, session: Session = Depends(get_read_session)):
+    rows = window_minutes(session, datetime.now(), [STATS_WINDOWS["1h"], STATS_WINDOWS["24h"]], [cam_id])
+    _, d1, d24 = rows[0] if rows else (cam_id, 0, 0)
+    return {"down_1h": int(d1), "down_24h": int(d24)}
 
 @app.get("/api/reports/generate")
-def generate_report(start: float, end: float, session: Session = Depends(get_session)):
+def generate_report(start: float, end: float, session: Session = Depends(get_read_session)):
+    start_dt = datetime.fromtimestamp(start)
+    end_dt = datetime.fromtimestamp(end)
+    return downtime_report(session, start_dt, end_dt)
+
+EXPORTS = {"downtime": export.downtime_events, "logs": export.logs, "uptime": export.uptime}
+
+@app.get("/api/export/{kind}")
+def export_data(kind: str, start: float = None, end: float = None, format: str = "csv", nvr_ip: str = None, camera_id: int = None):
+    """Streams downtime events, logs or per-camera uptime as CSV or NDJSON."""
+    if kind not in EXPORTS: raise HTTPException(status_code=404, detail=f"export must be one of {', '.join(EXPORTS)}")
+    if format not in export.FORMATS: raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(export.FORMATS)}")
+    start_dt = datetime.fromtimestamp(start) if start is not None else None
+    end_dt = datetime.fromtimestamp(end) if end is not None else None
+    if kind == "uptime":
+        if start_dt is None: raise HTTPException(status_code=400, detail="uptime export needs a start time")
+        end_dt = end_dt or datetime.now()
+    columns, rows = EXPORTS[kind](start_dt, end_dt, nvr_ip, camera_id)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M")
+    return StreamingResponse(export.encode(rows, columns, format), media_type=export.FORMATS[format],
+                             headers={"Content-Disposition": f'attachment; filename="{kind}-{stamp}.{format}"'})
+
+@app.get("/api/reports/rollup")
+def get_rollup(start: float, end: float, granularity: str = "day", camera_id: int = None, session: Session = Depends(get_read_session)):
+    if granularity not in BUCKET_FORMATS: raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(BUCKET_FORMATS)}")
     start_dt = datetime.fromtimestamp(start)
     end_dt = datetime.fromtimestamp(end)
-    cameras = session.exec(select(Camera)).all()
-    report_data = []
-    for c in cameras:
-        mins = calculate_downtime_range(session, c.id, start_dt, end_dt)
-        if mins > 0:
-            report_data.append({"name": c.name, "ip": c.ip, "mins": mins})
-    report_data.sort(key=lambda x: x['mins'], reverse=True)
-    return report_data
\ No newline at end of file
+    return bucket_minutes(session, start_dt, end_dt, granularity, [camera_id] if camera_id is not None else None)
\ No newline at end of file
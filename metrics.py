@@ -0,0 +1,78 @@
+import asyncio
+import re
+import time
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from sqlalchemy import event, func
+from sqlmodel import Session, select
+from database import engine, read_engine, AlertOutbox, Camera
+from camera_index import camera_index
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+# --- POLLING ---
+poll_seconds = Histogram("hik_poll_duration_seconds", "Status request round trip per NVR", ["nvr"], buckets=LATENCY_BUCKETS)
+poll_failures = Counter("hik_poll_failures_total", "Failed status polls per NVR", ["nvr"])
+parse_seconds = Histogram("hik_parse_duration_seconds", "Time to parse one channel status XML", buckets=FAST_BUCKETS)
+stream_events = Counter("hik_stream_events_total", "Camera state events read from alertStreams", ["event_type"])
+streams_connected = Gauge("hik_event_streams_connected", "NVRs with a live alertStream")
+
+# --- MONITOR CYCLE ---
+cycle_seconds = Histogram("hik_cycle_duration_seconds", "Monitor cycle from poll start to commit", buckets=LATENCY_BUCKETS)
+stage_seconds = Histogram("hik_cycle_stage_seconds", "Time spent in each monitor cycle stage", ["stage"], buckets=FAST_BUCKETS + (2.5, 5, 10))
+nvrs_polled = Counter("hik_nvrs_polled_total", "NVR status polls started")
+rows_written = Counter("hik_db_rows_written_total", "Rows written to SQLite", ["table", "op"])
+cameras = Gauge("hik_cameras", "Known cameras by status", ["status"])
+rows_archived = Counter("hik_rows_archived_total", "Rows moved to the monthly archive files", ["table"])
+logs_dropped = Counter("hik_logs_dropped_total", "Log rows lost because the log buffer was full")
+
+# --- ALERTS ---
+alerts_queued = Counter("hik_alerts_queued_total", "Alert batches put in the outbox", ["channel"])
+alert_outbox = Gauge("hik_alert_outbox", "Alert outbox rows by status", ["status"])
+alert_send_seconds = Histogram("hik_alert_send_duration_seconds", "Time to deliver one outbox row", ["channel"], buckets=LATENCY_BUCKETS)
+alert_delay_seconds = Histogram("hik_alert_delivery_delay_seconds", "From queueing to delivery", ["channel"], buckets=(1, 5, 15, 30, 60, 300, 900, 3600))
+alert_sends = Counter("hik_alert_sends_total", "Delivery attempts by outcome", ["channel", "result"])
+
+class timed:
+    """Context manager observing elapsed seconds into a histogram (or labelled child)."""
+
+    def __init__(self, metric):
+        self.metric = metric
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metric.observe(time.perf_counter() - self.start)
+
+WRITE_RE = re.compile(r"^\s*(INSERT|UPDATE|DELETE)(?:\s+OR\s+\w+)?\s+(?:INTO\s+|FROM\s+)?\"?(\w+)", re.I)
+
+@event.listens_for(engine, "after_cursor_execute")
+def _count_writes(conn, cursor, statement, parameters, context, executemany):
+    m = WRITE_RE.match(statement)
+    if not m: return
+    rows = cursor.rowcount
+    # INSERT ... RETURNING reports no rowcount; count its VALUES groups instead
+    if rows < 1 and " RETURNING " in statement: rows = statement.count("), (") + 1
+    if rows > 0: rows_written.labels(m.group(2).lower(), m.group(1).lower()).inc(rows)
+
+def _camera_counts():
+    with Session(read_engine) as session:
+        return dict(session.exec(select(Camera.status, func.count()).group_by(Camera.status)).all())
+
+def _outbox_counts():
+    with Session(read_engine) as session:
+        return dict(session.exec(select(AlertOutbox.status, func.count()).group_by(AlertOutbox.status)).all())
+
+async def render():
+    """Refreshes the scrape-time gauges and returns the exposition text."""
+    # The camera index belongs to the event loop, so it is read here rather than in a worker thread
+    counts = {"Online": 0, "Offline": 0}
+    if camera_index.loaded:
+        for cam in camera_index.all(): counts[cam.status] = counts.get(cam.status, 0) + 1
+    else: counts.update(await asyncio.to_thread(_camera_counts))
+    for status, n in counts.items(): cameras.labels(status).set(n)
+    rows = await asyncio.to_thread(_outbox_counts)
+    for status in ("pending", "sent", "failed", "cancelled"): alert_outbox.labels(status).set(rows.get(status, 0))
+    return generate_latest()
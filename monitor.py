@@ -1,84 +1,48 @@
 import asyncio
-import requests
-import xml.etree.ElementTree as ET
-import csv
-import os
+import time
 from datetime import datetime, timedelta
-from requests.auth import HTTPDigestAuth
 from sqlmodel import Session, select
-from database import engine, NVR, Camera, Log, Settings, DowntimeEvent
-from alerts import send_email_batch, send_telegram_batch
+from database import read_engine, write_session, NVR, Camera, DowntimeEvent
+from alerts import queue_email_batch, queue_telegram_batch
+from dispatcher import alert_dispatcher
+from poller import NVRPoller
+from camera_index import camera_index
+from rollup import add_intervals, close_open_events, reopen_events
+from logsink import log_sink
+from reports import range_minutes
+from config import settings_cache
+from camera_meta import camera_meta
+from camera_events import camera_hub
+from alert_schedule import alert_schedule
+from scheduler import PollScheduler
+from alertstream import EventStreams
+from flap import flap_damper
+import metrics
 
-def get_setting(session, key, default):
-    s = session.get(Settings, key)
-    return s.value if s else default
+def log_event(l_type, state, details):
+    log_sink.put(l_type, state, details)
 
-def load_csv_names():
-    mapping = {}
-    if os.path.exists("camera_names.csv"):
-        try:
-            with open("camera_names.csv", "r", encoding="utf-8-sig") as f:
-                reader = csv.reader(f)
-                next(reader, None)
-                for row in reader:
-                    if len(row) >= 2 and row[0].strip():
-                        mapping[row[0].strip()] = row[1].strip()
-        except: pass
-    return mapping
-
-def log_event(session, l_type, state, details):
-    try:
-        session.add(Log(log_type=l_type, state=state, details=details))
-        session.commit() 
-    except: pass
-
-def poll_nvr_thread(nvr_data):
-    ip, user, password = nvr_data
-    url = f"http://{ip}/ISAPI/ContentMgmt/InputProxy/channels/status"
-    try:
-        resp = requests.get(url, auth=HTTPDigestAuth(user, password), timeout=6, proxies={})
-        if resp.status_code == 200:
-            root = ET.fromstring(resp.content)
-            namespace = {'ns': 'http://www.hikvision.com/ver20/XMLSchema'}
-            results = []
-            for channel in root.findall('ns:InputProxyChannelStatus', namespace):
-                chan_id = channel.find('ns:id', namespace).text
-                online = channel.find('ns:online', namespace).text == 'true'
-                port = channel.find('ns:sourceInputPortDescriptor', namespace)
-                cam_ip = port.find('ns:ipAddress', namespace).text if port is not None else "0.0.0.0"
-                results.append({"channel_id": chan_id, "ip": cam_ip, "online": online})
-            return ("OK", results)
-        return ("FAIL", f"HTTP {resp.status_code}")
-    except Exception as e:
-        return ("FAIL", str(e))
-
-async def process_batch_alerts(session, cams_to_check):
+async def process_batch_alerts(cams_to_check):
     tele_alerts = []
     mail_alerts = []
     tele_recoveries = []
     mail_recoveries = []
     now = datetime.now()
 
-    # Load Settings
-    mail_delay = int(get_setting(session, "MAIL_FIRST_ALERT_DELAY_MINUTES", 1))
-    mail_low_delay = int(get_setting(session, "MAIL_LOW_IMPORTANCE_DELAY_MINUTES", 30)) # NEW
-    mail_freq = int(get_setting(session, "MAIL_ALERT_FREQUENCY_MINUTES", 60))
-    mail_mute = int(get_setting(session, "MAIL_MUTE_AFTER_N_ALERTS", 3))
-
-    tele_delay = int(get_setting(session, "TELEGRAM_FIRST_ALERT_DELAY_MINUTES", 1))
-    tele_low_delay = int(get_setting(session, "TELEGRAM_LOW_IMPORTANCE_DELAY_MINUTES", 15)) # NEW
-    tele_freq = int(get_setting(session, "TELEGRAM_ALERT_FREQUENCY_MINUTES", 30))
-    tele_mute = int(get_setting(session, "TELEGRAM_MUTE_AFTER_N_ALERTS", 3))
+    cfg = settings_cache.get()
+    mail_delay, mail_low_delay, mail_freq, mail_mute = cfg.mail_delay, cfg.mail_low_delay, cfg.mail_freq, cfg.mail_mute
+    tele_delay, tele_low_delay, tele_freq, tele_mute = cfg.tele_delay, cfg.tele_low_delay, cfg.tele_freq, cfg.tele_mute
 
     for cam in cams_to_check:
+        # Flapping cameras neither alert nor recover until they settle
+        if cam.status == "Flapping": continue
         if cam.status == "Online":
             if cam.telegram_alert_count > 0:
                 tele_recoveries.append(f"✅ {cam.name} is back Online")
-                cam.telegram_alert_count = 0
+                camera_index.set(cam, telegram_alert_count=0)
             if cam.mail_alert_count > 0:
                 mail_recoveries.append(f"{cam.name} is back Online")
-                cam.mail_alert_count = 0
-            session.add(cam)
+                camera_index.set(cam, mail_alert_count=0)
             continue
 
         downtime = now - (cam.last_online or now)
@@ -99,9 +63,7 @@ async def process_batch_alerts(session, cams_to_check):
             msg = f"🚨 {cam.name} ({downtime_mins}m)"
             if cam.telegram_alert_count + 1 >= tele_mute: msg += " 🔕(Muted)"
             tele_alerts.append(msg)
-            cam.telegram_alert_count += 1
-            cam.telegram_last_alert = now
-            session.add(cam)
+            camera_index.set(cam, telegram_alert_count=cam.telegram_alert_count + 1, telegram_last_alert=now)
 
         # --- MAIL ---
         send_mail = False
@@ -117,111 +79,314 @@ async def process_batch_alerts(session, cams_to_check):
             msg = f"{cam.name} is offline for {downtime_mins} mins"
             if cam.mail_alert_count + 1 >= mail_mute: msg += " (Muted)"
             mail_alerts.append(msg)
-            cam.mail_alert_count += 1
-            cam.mail_last_alert = now
-            session.add(cam)
+            camera_index.set(cam, mail_alert_count=cam.mail_alert_count + 1, mail_last_alert=now)
 
     return tele_alerts, mail_alerts, tele_recoveries, mail_recoveries
 
-async def start_monitor_loop():
+def apply_camera_meta(meta_map):
+    # CSV changed: re-apply names/importance to every known camera
+    for cam in camera_index.all():
+        meta = meta_map.get(cam.ip)
+        if not meta: continue
+        camera_index.set(cam, name=meta.name)
+        if meta.importance and camera_index.set(cam, importance=meta.importance): alert_schedule.touch(cam.id)
+
+def observe(cam, online, now, cfg, edges, changed, confirm=None):
+    """Runs one observation of a camera through the flap damper.
+
+    Downtime edges are appended to `edges`, cameras whose status changed go in
+    `changed`. Returns True if the camera changed or has a change pending.
+    """
+    edge, pending = flap_damper.observe(cam, online, now, cfg, confirm)
+    if edge: edges.setdefault(cam.id, []).append(edge)
+    if online and not flap_damper.state[cam.id].down: camera_index.touch_online(cam, now)
+    new_status = flap_damper.status(cam.id)
+    if new_status == cam.status: return pending or edge is not None
+    log_event("Camera", new_status, f"{cam.name} ({cam.ip})")
+    camera_index.set(cam, status=new_status)
+    if new_status == "Offline": camera_index.mark_last_online(cam)
+    changed[cam.id] = cam
+    return True
+
+def process_results(session, nvrs, results, meta_map, now, cfg, edges, changed):
+    """Diffs one batch of poll results against the camera index.
+
+    Returns (new cameras, ips of NVRs whose cameras changed or are changing state).
+    """
+    new_cams = []
+    changed_nvrs = set()
+    for nvr_obj, res in zip(nvrs, results):
+        status, payload = res
+        if status == "FAIL":
+            log_event("Camera", "Error", f"NVR {nvr_obj.ip} Failed: {payload}")
+            continue
+            
+        for d in payload:
+            db_cam = camera_index.get(nvr_obj.ip, d['channel_id'])
+            meta = meta_map.get(d['ip'])
+
+            if not db_cam:
+                new_status = "Online" if d['online'] else "Offline"
+                db_cam = Camera(name=meta.name if meta else f"Ch {d['channel_id']}", ip=d['ip'], nvr_ip=nvr_obj.ip, channel_id=d['channel_id'], status=new_status, last_online=now if d['online'] else None)
+                if meta and meta.importance: db_cam.importance = meta.importance
+                new_cams.append(db_cam)
+            else:
+                # A different camera behind this channel picks up its CSV metadata
+                if camera_index.set(db_cam, ip=d['ip']) and meta:
+                    camera_index.set(db_cam, name=meta.name)
+                    if meta.importance: camera_index.set(db_cam, importance=meta.importance)
+                
+                if observe(db_cam, d['online'], now, cfg, edges, changed): changed_nvrs.add(nvr_obj.ip)
+
+    camera_index.insert(session, new_cams)
+    for c in new_cams:
+        changed[c.id] = c
+        if c.status == "Offline": edges[c.id] = [("Offline", now, None)]
+    return new_cams, changed_nvrs
+
+def apply_events(events, now, cfg, edges, changed):
+    """Applies alertStream events to known cameras.
+
+    An event is the NVR's own report of a change, so it needs no confirming polls.
+    """
+    for nvr_ip, event in events:
+        metrics.stream_events.labels(event.event_type).inc()
+        cam = camera_index.get(nvr_ip, event.channel_id)
+        if cam: observe(cam, not event.active, now, cfg, edges, changed, confirm=1)
+
+def record_transitions(session, edges):
+    """Writes one cycle's downtime edges, {camera_id: [(status, when, continues), ...]}.
+
+    A camera's edges are folded first, so flips inside one cycle cost only their
+    net effect. An Offline edge that `continues` an outage ending at that time
+    reopens it rather than starting a new one.
+    """
+    ends, reopen, fresh = {}, {}, []
+    for cid, evs in edges.items():
+        # Outages touched this cycle as [kind, start, end, continues]: "open" is the event
+        # already open before it, "reopen" continues one closed in an earlier cycle
+        outages = [["open", None, None, None]] if evs[0][0] == "Online" else []
+        for status, when, cont in evs:
+            if status == "Online": outages[-1][2] = when
+            elif cont is not None and outages and outages[-1][2] == cont: outages[-1][2] = None
+            else: outages.append(["reopen" if cont else "new", when, None, cont])
+        for kind, start, end, cont in outages:
+            if kind == "open":
+                if end is not None: ends[cid] = end
+            elif kind == "reopen": reopen[cid] = (cont, start, end)
+            else: fresh.append((cid, start, end))
+
+    found = reopen_events(session, {cid: cont for cid, (cont, _, _) in reopen.items()})
+    for cid, (cont, start, end) in reopen.items():
+        if cid not in found: fresh.append((cid, start, end))
+        elif end is not None: ends[cid] = end
+    close_open_events(session, ends)
+    if fresh:
+        session.add_all([DowntimeEvent(camera_id=cid, start_time=start, end_time=end) for cid, start, end in fresh])
+        add_intervals(session, [(cid, start, end) for cid, start, end in fresh if end is not None])
+
+def queue_hourly_summary(session, now):
+    hour_start = now.replace(minute=0, second=0, microsecond=0)
+    # The hour that just ended, read from the hourly rollup
+    down = range_minutes(session, hour_start - timedelta(hours=1), hour_start)
+    summary_lines = []
+    for cam_id, minutes_down in sorted(down.items(), key=lambda x: x[1], reverse=True):
+        c = camera_index.by_id.get(cam_id)
+        if c and minutes_down > 0:
+            summary_lines.append(f"{c.name}: {minutes_down}m")
+
+    if summary_lines:
+        header = f"📊 Hourly Downtime Summary ({now.strftime('%H:00')})"
+        queue_telegram_batch(session, header, summary_lines)
+
+NVR_REFRESH_SECONDS = 5
+
+async def queue_alerts(session, cfg, changed_cams, now):
+    """Runs the alert rules for cameras that changed state or whose next alert is due."""
+    if alert_schedule.version != cfg.version: alert_schedule.rebuild(camera_index.all(), cfg)
+    cams = {c.id: c for c in changed_cams}
+    for cid in alert_schedule.pop_due(now) + list(alert_schedule.take_touched()):
+        cam = camera_index.by_id.get(cid)
+        if cam: cams[cid] = cam
+    if not cams: return
+    t_alerts, m_alerts, t_recov, m_recov = await process_batch_alerts(cams.values())
+    for cam in cams.values(): alert_schedule.update(cam, cfg)
+
+    # Delivered by the background dispatcher once this cycle commits
+    queue_telegram_batch(session, "⚠️ Cameras Offline", t_alerts)
+    queue_telegram_batch(session, "✅ Cameras Recovered", t_recov)
+    queue_email_batch(session, "⚠️ Cameras Offline Alert", m_alerts)
+    queue_email_batch(session, "✅ Cameras Recovered", m_recov)
+
+def alert_wait():
+    """Seconds until the next alert is due (0 if overdue), or None."""
+    due = alert_schedule.next_due()
+    return None if due is None else max(0.0, (due - datetime.now()).total_seconds())
+
+async def start_monitor_loop(shard=None):
+    """Polls NVRs and persists camera state.
+
+    With a `shard` (sharding.LeaseShard, started) only the NVRs it leases are polled,
+    and alerts and the hourly summary are left to start_coordinator_loop().
+    """
     print("👀 Monitor loop started...")
-    last_summary_hour = -1
-    
-    with Session(engine) as session:
-        log_event(session, "Service", "Started", "Monitor loop initialized")
+    last_summary_hour = datetime.now().hour
+    applied_meta_version = None
+    poller = NVRPoller()
+    streams = EventStreams(poller)
+    scheduler = PollScheduler()
+    nvr_map = {}
+    nvrs_loaded_at = 0
+    shard_ips = None
+    camera_index.invalidate()
+    log_sink.start()
+    if shard is None: alert_dispatcher.start()
+    log_event("Service", "Started", "Monitor loop initialized")
 
     while True:
         try:
-            name_map = load_csv_names()
-            with Session(engine) as session:
-                nvrs = session.exec(select(NVR).where(NVR.enabled == True)).all()
+            cfg = settings_cache.get()
+            loop_now = time.monotonic()
+            if loop_now - nvrs_loaded_at >= NVR_REFRESH_SECONDS:
+                # Settings are edited through the API process
+                if shard: cfg = settings_cache.reload()
+                with Session(read_engine) as session:
+                    enabled = {n.ip: n for n in session.exec(select(NVR).where(NVR.enabled == True)).all()}
+                if shard:
+                    owned = shard.held()
+                    if owned != shard_ips: camera_index.invalidate()
+                    shard_ips = owned
+                    enabled = {ip: n for ip, n in enabled.items() if ip in owned}
+                nvr_map = enabled
+                await poller.prune(set(nvr_map))
+                await streams.sync([(n.ip, n.user, n.password) for n in nvr_map.values()] if cfg.poll_events else [])
+                # While an NVR's event stream is up, status polls only reconcile
+                scheduler.sync([(n.ip, n.poll_interval or (cfg.poll_reconcile if streams.connected(n.ip) else None)) for n in nvr_map.values()], cfg.poll_interval)
+                metrics.streams_connected.set(sum(streams.connected(ip) for ip in nvr_map))
+                nvrs_loaded_at = loop_now
 
-            if not nvrs:
+            if not nvr_map:
                 await asyncio.sleep(10)
                 continue
-            
-            tasks = [asyncio.to_thread(poll_nvr_thread, (n.ip, n.user, n.password)) for n in nvrs]
-            results = await asyncio.gather(*tasks)
-
-            cams_processed = []
-
-            with Session(engine) as session:
-                for nvr_obj, res in zip(nvrs, results):
-                    status, payload = res
-                    if status == "FAIL":
-                        log_event(session, "Camera", "Error", f"NVR {nvr_obj.ip} Failed: {payload}")
-                        continue
-                        
-                    for d in payload:
-                        stmt = select(Camera).where(Camera.nvr_ip == nvr_obj.ip, Camera.channel_id == d['channel_id'])
-                        db_cam = session.exec(stmt).first()
-                        new_status = "Online" if d['online'] else "Offline"
-                        
-                        csv_name = name_map.get(d['ip'])
-                        final_name = csv_name if csv_name else f"Ch {d['channel_id']}"
-
-                        if not db_cam:
-                            db_cam = Camera(name=final_name, ip=d['ip'], nvr_ip=nvr_obj.ip, channel_id=d['channel_id'], status=new_status, last_online=datetime.now() if d['online'] else None)
-                            session.add(db_cam)
-                            session.flush() 
-                            session.refresh(db_cam)
-                            if new_status == "Offline":
-                                session.add(DowntimeEvent(camera_id=db_cam.id, start_time=datetime.now()))
-                        else:
-                            if csv_name and db_cam.name != csv_name: db_cam.name = csv_name
-                            if db_cam.ip != d['ip']: db_cam.ip = d['ip']
-                            
-                            if db_cam.status != new_status:
-                                log_event(session, "Camera", new_status, f"{db_cam.name} ({db_cam.ip})")
-                                db_cam.status = new_status
-                                if new_status == "Offline":
-                                    session.add(DowntimeEvent(camera_id=db_cam.id, start_time=datetime.now()))
-                                elif new_status == "Online":
-                                    open_evt = session.exec(select(DowntimeEvent).where(DowntimeEvent.camera_id == db_cam.id, DowntimeEvent.end_time == None)).first()
-                                    if open_evt:
-                                        open_evt.end_time = datetime.now()
-                                        session.add(open_evt)
-                            
-                            if d['online']: db_cam.last_online = datetime.now()
-                            session.add(db_cam)
-                        
-                        cams_processed.append(db_cam)
-
-                t_alerts, m_alerts, t_recov, m_recov = await process_batch_alerts(session, cams_processed)
-                
-                if t_alerts:
-                    res = await asyncio.to_thread(send_telegram_batch, "⚠️ Cameras Offline", t_alerts)
-                    log_event(session, "Telegram", "Sent" if res is True else "Failed", f"Sent {len(t_alerts)} alerts")
-                if t_recov:
-                    await asyncio.to_thread(send_telegram_batch, "✅ Cameras Recovered", t_recov)
-                if m_alerts:
-                    await asyncio.to_thread(send_email_batch, "⚠️ Cameras Offline Alert", m_alerts)
-                if m_recov:
-                    await asyncio.to_thread(send_email_batch, "✅ Cameras Recovered", m_recov)
 
+            due = [nvr_map[ip] for ip in scheduler.due() if ip in nvr_map]
+            events = streams.drain()
+            summary_due = shard is None and datetime.now().hour != last_summary_hour
+            alert_in = alert_wait() if shard is None else None
+            if not (due or events or summary_due or alert_in == 0):
+                waits = [w for w in (scheduler.seconds_until_next(), alert_in) if w is not None]
+                events = await streams.wait(min(waits + [NVR_REFRESH_SECONDS]))
+                if not events: continue
+
+            if cfg.poll_concurrency != poller.concurrency: poller.set_concurrency(cfg.poll_concurrency)
+            cycle_start = time.perf_counter()
+            metrics.nvrs_polled.inc(len(due))
+            with metrics.timed(metrics.stage_seconds.labels("poll")):
+                results = await poller.poll_all([(n.ip, n.user, n.password) for n in due]) if due else []
+            if shard:
+                # A slow cycle may have outlived a lease; another worker owns those NVRs now
+                owned = shard.held()
+                if owned != shard_ips:
+                    kept = [i for i, n in enumerate(due) if n.ip in owned]
+                    due, results = [due[i] for i in kept], [results[i] for i in kept]
+                    events = [(ip, e) for ip, e in events if ip in owned]
+                    nvrs_loaded_at = 0
+                    if not (due or events): continue
+
+            if not camera_index.loaded:
+                camera_index.load(shard_ips)
+                flap_damper.load(camera_index.all())
+                camera_hub.resync_all()
+                if shard is None: alert_schedule.rebuild(camera_index.all(), cfg)
+            meta_map = camera_meta.get()
+            meta_version = camera_meta.version
+            if meta_version != applied_meta_version: apply_camera_meta(meta_map)
+
+            async with write_session() as session:
                 now = datetime.now()
-                if now.minute == 0 and now.hour != last_summary_hour:
-                    hour_start = now.replace(minute=0, second=0, microsecond=0)
-                    summary_lines = []
-                    for c in cams_processed:
-                        if c.status == "Offline":
-                            offline_since = c.last_online or now
-                            overlap_start = max(hour_start, offline_since)
-                            minutes_down = int((now - overlap_start).total_seconds() / 60)
-                            if minutes_down > 0:
-                                summary_lines.append(f"{c.name}: {minutes_down}m")
-
-                    if summary_lines:
-                        header = f"📊 Hourly Downtime Summary ({now.strftime('%H:00')})"
-                        await asyncio.to_thread(send_telegram_batch, header, summary_lines)
-                        log_event(session, "Telegram", "Sent", "Hourly Summary")
+                with metrics.timed(metrics.stage_seconds.labels("process")):
+                    edges, changed = {}, {}
+                    new_cams, changed_nvrs = process_results(session, due, results, meta_map, now, cfg, edges, changed)
+                    apply_events(events, now, cfg, edges, changed)
+                    record_transitions(session, edges)
+
+                if shard is None:
+                    with metrics.timed(metrics.stage_seconds.labels("alerts")):
+                        await queue_alerts(session, cfg, list(changed.values()), now)
+
+                    now = datetime.now()
+                    if now.hour != last_summary_hour:
+                        queue_hourly_summary(session, now)
+                        last_summary_hour = now.hour
+
+                changed_ids = set(camera_index.dirty) | {c.id for c in new_cams}
+                with metrics.timed(metrics.stage_seconds.labels("commit")):
+                    camera_index.flush(session)
+                    session.commit()
+                camera_index.committed()
+                metrics.cycle_seconds.observe(time.perf_counter() - cycle_start)
+                camera_hub.publish(changed_ids)
+                alert_dispatcher.notify()
+                applied_meta_version = meta_version
+
+            for nvr_obj, (status, _) in zip(due, results):
+                scheduler.on_result(nvr_obj.ip, status == "OK", nvr_obj.ip in changed_nvrs)
+
+        except asyncio.CancelledError:
+            break
+        except Exception as e: 
+            print(f"Error: {e}")
+            camera_index.invalidate()
+            try: await asyncio.sleep(5)
+            except asyncio.CancelledError: break
+
+    try: await streams.close()
+    finally: await poller.close()
+
+COORDINATOR_INTERVAL = 5
+
+async def start_coordinator_loop():
+    """Sharded mode: worker processes poll; this evaluates alerts and the hourly
+    summary for every camera and keeps the dashboard's camera index current."""
+    print("🧭 Coordinator loop started...")
+    last_summary_hour = datetime.now().hour
+    camera_index.invalidate()
+    log_sink.start()
+    alert_dispatcher.start()
+    log_event("Service", "Started", "Coordinator initialized")
+
+    while True:
+        try:
+            cfg = settings_cache.get()
+            changed = []
+            if not camera_index.loaded:
+                camera_index.load()
+                camera_hub.resync_all()
+                alert_schedule.rebuild(camera_index.all(), cfg)
+            else:
+                changed = camera_index.refresh(await asyncio.to_thread(camera_index.read_rows))
+                camera_hub.publish(changed)
+
+            async with write_session() as session:
+                with metrics.timed(metrics.stage_seconds.labels("alerts")):
+                    await queue_alerts(session, cfg, [camera_index.by_id[cid] for cid in changed if cid in camera_index.by_id], datetime.now())
+
+                now = datetime.now()
+                if now.hour != last_summary_hour:
+                    queue_hourly_summary(session, now)
                     last_summary_hour = now.hour
 
+                changed_ids = set(camera_index.dirty)
+                camera_index.flush(session)
                 session.commit()
-            await asyncio.sleep(60) 
+                camera_index.committed()
+                camera_hub.publish(changed_ids)
+                alert_dispatcher.notify()
 
+            await asyncio.sleep(COORDINATOR_INTERVAL)
         except asyncio.CancelledError:
             break
-        except Exception as e: 
+        except Exception as e:
             print(f"Error: {e}")
-            await asyncio.sleep(5)
\ No newline at end of file
+            camera_index.invalidate()
+            await asyncio.sleep(5)
@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import os
+import time
+import xml.etree.ElementTree as ET
+import aiohttp
+import metrics
+
+STATUS_PATH = "/ISAPI/ContentMgmt/InputProxy/channels/status"
+NAMESPACE = {'ns': 'http://www.hikvision.com/ver20/XMLSchema'}
+
+def parse_channel_status(content):
+    root = ET.fromstring(content)
+    results = []
+    for channel in root.findall('ns:InputProxyChannelStatus', NAMESPACE):
+        chan_id = channel.find('ns:id', NAMESPACE).text
+        online = channel.find('ns:online', NAMESPACE).text == 'true'
+        port = channel.find('ns:sourceInputPortDescriptor', NAMESPACE)
+        ip_el = port.find('ns:ipAddress', NAMESPACE) if port is not None else None
+        cam_ip = ip_el.text if ip_el is not None else "0.0.0.0"
+        results.append({"channel_id": chan_id, "ip": cam_ip, "online": online})
+    return results
+
+def parse_digest_challenge(header):
+    # WWW-Authenticate: Digest realm="...", nonce="...", qop="auth", ...
+    if not header or not header.lower().startswith("digest"): return None
+    params = {}
+    for part in _split_params(header[6:]):
+        if "=" not in part: continue
+        k, v = part.split("=", 1)
+        params[k.strip().lower()] = v.strip().strip('"')
+    return params if "nonce" in params else None
+
+def _split_params(s):
+    parts, buf, quoted = [], "", False
+    for ch in s:
+        if ch == '"': quoted = not quoted
+        if ch == "," and not quoted:
+            parts.append(buf.strip()); buf = ""
+        else: buf += ch
+    if buf.strip(): parts.append(buf.strip())
+    return parts
+
+class DigestAuth:
+    """Digest credentials plus the last server challenge, so the nonce is reused across requests."""
+
+    def __init__(self, user, password):
+        self.user = user
+        self.password = password or ""
+        self.challenge = None
+        self.nc = 0
+
+    def update(self, header):
+        chal = parse_digest_challenge(header)
+        if not chal: return False
+        if not self.challenge or chal.get("nonce") != self.challenge.get("nonce"): self.nc = 0
+        self.challenge = chal
+        return True
+
+    def header(self, method, path):
+        if not self.challenge: return None
+        c = self.challenge
+        algo = c.get("algorithm", "MD5").upper()
+        h = (lambda s: hashlib.sha256(s.encode()).hexdigest()) if algo.startswith("SHA-256") else (lambda s: hashlib.md5(s.encode()).hexdigest())
+        realm, nonce = c.get("realm", ""), c["nonce"]
+        self.nc += 1
+        nc = f"{self.nc:08x}"
+        cnonce = os.urandom(8).hex()
+        ha1 = h(f"{self.user}:{realm}:{self.password}")
+        if algo.endswith("-SESS"): ha1 = h(f"{ha1}:{nonce}:{cnonce}")
+        ha2 = h(f"{method}:{path}")
+        qop = "auth" if "auth" in [q.strip() for q in c.get("qop", "").split(",")] else None
+        if qop: response = h(f"{ha1}:{nonce}:{nc}:{cnonce}:{qop}:{ha2}")
+        else: response = h(f"{ha1}:{nonce}:{ha2}")
+        parts = [f'username="{self.user}"', f'realm="{realm}"', f'nonce="{nonce}"', f'uri="{path}"', f'response="{response}"', f'algorithm={c.get("algorithm", "MD5")}']
+        if "opaque" in c: parts.append(f'opaque="{c["opaque"]}"')
+        if qop: parts += [f"qop={qop}", f"nc={nc}", f'cnonce="{cnonce}"']
+        return "Digest " + ", ".join(parts)
+
+class NVRClient:
+    """One pooled keep-alive HTTP session per NVR."""
+
+    def __init__(self, ip, user, password, timeout=6):
+        self.ip = ip
+        self.creds = (user, password)
+        self.auth = DigestAuth(user, password)
+        self.timeout = timeout
+        self.session = None
+
+    def _session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=3, keepalive_timeout=300)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self.session
+
+    async def get(self, path):
+        url = f"http://{self.ip}{path}"
+        session = self._session()
+        # Second attempt only happens after a fresh (or stale) challenge
+        for _ in range(2):
+            auth = self.auth.header("GET", path)
+            headers = {"Authorization": auth} if auth else {}
+            async with session.get(url, headers=headers) as resp:
+                body = await resp.read()
+                if resp.status == 401 and self.auth.update(resp.headers.get("WWW-Authenticate")): continue
+                return resp.status, body
+        return resp.status, body
+
+    async def open(self, path, timeout=None):
+        """Like get() but returns the unread response for streaming; the caller releases it."""
+        url = f"http://{self.ip}{path}"
+        session = self._session()
+        for _ in range(2):
+            auth = self.auth.header("GET", path)
+            headers = {"Authorization": auth} if auth else {}
+            resp = await session.get(url, headers=headers, timeout=timeout or session.timeout)
+            if resp.status == 401 and self.auth.update(resp.headers.get("WWW-Authenticate")):
+                resp.release(); continue
+            return resp
+        return resp
+
+    async def poll(self):
+        start = time.perf_counter()
+        try:
+            status, body = await self.get(STATUS_PATH)
+            metrics.poll_seconds.labels(self.ip).observe(time.perf_counter() - start)
+            if status == 200:
+                with metrics.timed(metrics.parse_seconds): return ("OK", parse_channel_status(body))
+            result = ("FAIL", f"HTTP {status}")
+        except asyncio.TimeoutError:
+            result = ("FAIL", "Timeout")
+        except Exception as e:
+            result = ("FAIL", str(e) or type(e).__name__)
+        metrics.poll_failures.labels(self.ip).inc()
+        return result
+
+    async def close(self):
+        if self.session and not self.session.closed: await self.session.close()
+
+class NVRPoller:
+    """Polls a fleet of NVRs concurrently, keeping one client per NVR between cycles."""
+
+    def __init__(self, concurrency=32, timeout=6):
+        self.clients = {}
+        self.closing = set()    # close() tasks of replaced clients, kept until done
+        self.timeout = timeout
+        self.set_concurrency(concurrency)
+
+    def set_concurrency(self, concurrency):
+        self.concurrency = max(1, int(concurrency))
+        self.sem = asyncio.Semaphore(self.concurrency)
+
+    def client(self, ip, user, password):
+        c = self.clients.get(ip)
+        if c is None or c.creds != (user, password):
+            if c:
+                task = asyncio.create_task(c.close())
+                self.closing.add(task)
+                task.add_done_callback(self.closing.discard)
+            c = self.clients[ip] = NVRClient(ip, user, password, self.timeout)
+        return c
+
+    async def prune(self, active_ips):
+        for ip in [ip for ip in self.clients if ip not in active_ips]:
+            await self.clients.pop(ip).close()
+
+    async def _poll_one(self, client):
+        async with self.sem:
+            return await client.poll()
+
+    async def poll_all(self, nvrs):
+        """Takes (ip, user, password) tuples, returns ("OK", channels) / ("FAIL", reason) in the same order."""
+        return await asyncio.gather(*[self._poll_one(self.client(*n)) for n in nvrs])
+
+    async def close(self):
+        clients, self.clients = list(self.clients.values()), {}
+        results = await asyncio.gather(*[c.close() for c in clients], *self.closing, return_exceptions=True)
+        for r in results:
+            if isinstance(r, Exception): print(f"NVR client close error: {r}")
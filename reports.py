@@ -0,0 +1,105 @@
+from collections import defaultdict
+from datetime import datetime
+from sqlmodel import select, func, or_
+from database import Camera, DowntimeEvent, DowntimeHourly
+from rollup import BUCKET_FORMATS, hour_ceil, hour_floor, rollup_minutes, split_hours
+import archive
+
+def _overlap_minutes(start_ts, end_ts, now):
+    # Clip each event to [start_ts, end_ts] in SQL; open events run until now
+    ev_end = func.coalesce(DowntimeEvent.end_time, now)
+    clip_start = func.max(DowntimeEvent.start_time, start_ts)
+    clip_end = func.min(ev_end, end_ts)
+    # An open event clipped to a range past `now` would come out negative
+    return func.sum(func.max(0.0, (func.julianday(clip_end) - func.julianday(clip_start)) * 1440.0))
+
+def _overlapping(stmt, start_ts, end_ts, camera_ids=None, open_only=False):
+    if open_only: stmt = stmt.where(DowntimeEvent.start_time < end_ts, DowntimeEvent.end_time == None)
+    else: stmt = stmt.where(
+        DowntimeEvent.start_time < end_ts,
+        or_(DowntimeEvent.end_time == None, DowntimeEvent.end_time > start_ts),
+    )
+    if camera_ids is not None: stmt = stmt.where(DowntimeEvent.camera_id.in_(camera_ids))
+    return stmt
+
+def _raw_minutes(session, start_ts, end_ts, camera_ids=None, open_only=False):
+    now = datetime.now()
+    stmt = select(DowntimeEvent.camera_id, _overlap_minutes(start_ts, end_ts, now)).group_by(DowntimeEvent.camera_id)
+    mins = {cid: mins or 0 for cid, mins in session.exec(_overlapping(stmt, start_ts, end_ts, camera_ids, open_only)).all()}
+    if open_only: return mins
+    # Events past retention live in the monthly archive (nothing is read for recent ranges)
+    for cid, m in archive.downtime_minutes(start_ts, end_ts, camera_ids).items(): mins[cid] = mins.get(cid, 0) + m
+    return mins
+
+def downtime_minutes(session, start_ts, end_ts, camera_ids=None):
+    """{camera_id: minutes down inside [start_ts, end_ts]} from one aggregate query."""
+    return {cid: int(mins) for cid, mins in _raw_minutes(session, start_ts, end_ts, camera_ids).items()}
+
+def range_minutes(session, start_ts, end_ts, camera_ids=None):
+    """Like downtime_minutes, but whole hours are read from the hourly rollup.
+
+    Only the partial hours at both edges and still-open events touch DowntimeEvent.
+    """
+    first, last = hour_ceil(start_ts), hour_floor(end_ts)
+    if last <= first: return downtime_minutes(session, start_ts, end_ts, camera_ids)
+    totals = defaultdict(float)
+    parts = [rollup_minutes(session, first, last, camera_ids), _raw_minutes(session, first, last, camera_ids, open_only=True)]
+    if first > start_ts: parts.append(_raw_minutes(session, start_ts, first, camera_ids))
+    if end_ts > last: parts.append(_raw_minutes(session, last, end_ts, camera_ids))
+    for part in parts:
+        for cid, mins in part.items(): totals[cid] += mins
+    return {cid: int(mins) for cid, mins in totals.items()}
+
+def bucket_minutes(session, start_ts, end_ts, granularity="day", camera_ids=None):
+    """Downtime per camera per hour/day/month bucket inside [start_ts, end_ts], including the part of still-open events.
+
+    Whole hours come from the rollup; the partial hours at both edges are clipped from the raw events.
+    """
+    fmt = BUCKET_FORMATS[granularity]
+    acc = defaultdict(float)
+    first, last = hour_ceil(start_ts), hour_floor(end_ts)
+    edges = [(start_ts, end_ts)] if last < first else [(start_ts, first), (last, end_ts)]
+    if last > first:
+        bucket = func.strftime(fmt, DowntimeHourly.hour)
+        stmt = select(DowntimeHourly.camera_id, bucket, func.sum(DowntimeHourly.minutes)).where(
+            DowntimeHourly.hour >= first, DowntimeHourly.hour < last).group_by(DowntimeHourly.camera_id, bucket)
+        if camera_ids is not None: stmt = stmt.where(DowntimeHourly.camera_id.in_(camera_ids))
+        for cam_id, b, mins in session.exec(stmt): acc[(cam_id, b)] += mins
+        now = datetime.now()
+        open_stmt = _overlapping(select(DowntimeEvent.camera_id, DowntimeEvent.start_time), first, last, camera_ids, open_only=True)
+        for cam_id, started in session.exec(open_stmt):
+            for hour, mins in split_hours(max(started, first), min(now, last)):
+                acc[(cam_id, hour.strftime(fmt))] += mins
+    # Each edge lies inside a single hour, so it falls in that hour's bucket
+    for edge_start, edge_end in edges:
+        if edge_end <= edge_start: continue
+        for cam_id, mins in _raw_minutes(session, edge_start, edge_end, camera_ids).items():
+            acc[(cam_id, edge_start.strftime(fmt))] += mins
+
+    rows = [{"camera_id": c, "bucket": b, "mins": round(m, 1)} for (c, b), m in acc.items() if m > 0]
+    rows.sort(key=lambda r: (r["bucket"], r["camera_id"]))
+    return rows
+
+def window_minutes(session, now, spans, camera_ids=None):
+    """[(camera_id, minutes down in the last span for each of `spans`), ...] for every camera, ordered by id.
+
+    One query: a single pass over the events of the widest span, grouped per camera.
+    """
+    ev_end = func.min(func.coalesce(DowntimeEvent.end_time, now), now)
+    sums = [(func.sum(func.max(0.0, func.julianday(ev_end) - func.julianday(func.max(DowntimeEvent.start_time, now - span)))) * 1440.0).label(f"d{i}")
+            for i, span in enumerate(spans)]
+    down = select(DowntimeEvent.camera_id, *sums).where(
+        DowntimeEvent.start_time < now, or_(DowntimeEvent.end_time == None, DowntimeEvent.end_time > now - max(spans))).group_by(DowntimeEvent.camera_id)
+    if camera_ids is not None: down = down.where(DowntimeEvent.camera_id.in_(camera_ids))
+    down = down.subquery()
+    stmt = select(Camera.id, *[func.coalesce(down.c[f"d{i}"], 0) for i in range(len(spans))]).outerjoin(down, down.c.camera_id == Camera.id).order_by(Camera.id)
+    if camera_ids is not None: stmt = stmt.where(Camera.id.in_(camera_ids))
+    return session.exec(stmt).all()
+
+def downtime_report(session, start_ts, end_ts):
+    mins = {cid: m for cid, m in range_minutes(session, start_ts, end_ts).items() if m > 0}
+    if not mins: return []
+    cams = session.exec(select(Camera.id, Camera.name, Camera.ip).where(Camera.id.in_(list(mins)))).all()
+    report_data = [{"name": name, "ip": ip, "mins": mins[cid]} for cid, name, ip in cams]
+    report_data.sort(key=lambda x: x['mins'], reverse=True)
+    return report_data
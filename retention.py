@@ -0,0 +1,135 @@
+import asyncio
+from datetime import datetime, timedelta
+from sqlalchemy import delete
+from sqlmodel import Session, select
+from database import engine, read_engine, Log, DowntimeEvent, AlertOutbox
+from config import settings_cache
+import archive
+import database
+import metrics
+
+BATCH = 500                 # rows per archive/delete transaction
+PAUSE = 0.05                # between batches, so monitor writes get the writer in between
+VACUUM_PAGES = 1000         # pages released per incremental_vacuum step
+FTS_MERGE_PAGES = 500       # log_fts pages rewritten per merge step
+OUTBOX_KEEP = timedelta(days=7)
+FIRST_RUN_DELAY = 300
+RUN_INTERVAL = 6 * 3600
+
+class Retention:
+    """Background job: archives Log and closed DowntimeEvent rows past their retention
+    to monthly gzip files (archive.py), trims them from the hot tables in small
+    batches, purges finished AlertOutbox rows and gives the space back to the disk.
+
+    DowntimeHourly is kept, so reports over archived ranges still add up.
+    """
+
+    def __init__(self):
+        self.task = None
+        self.incremental = None
+
+    def start(self):
+        if self.task and not self.task.done(): return
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try: await self.task
+            except asyncio.CancelledError: pass
+            self.task = None
+
+    async def _run(self):
+        await asyncio.sleep(FIRST_RUN_DELAY)
+        while True:
+            try: await self.run_once()
+            except asyncio.CancelledError: raise
+            except Exception as e: print(f"Retention Error: {e}")
+            await asyncio.sleep(RUN_INTERVAL)
+
+    async def run_once(self, now=None):
+        """One full pass; returns {table: rows removed}."""
+        cfg = settings_cache.get()
+        now = now or datetime.now()
+        done = {"log": 0, "downtimeevent": 0, "alertoutbox": 0}
+        if cfg.log_retention:
+            done["log"] = await self._drain(self._archive_logs, now - timedelta(days=cfg.log_retention))
+        if cfg.downtime_retention:
+            done["downtimeevent"] = await self._drain(self._archive_downtime, now - timedelta(days=cfg.downtime_retention))
+        done["alertoutbox"] = await self._drain(self._purge_outbox, now - OUTBOX_KEEP)
+        # FTS5 only records deletes; merging its segments is what frees the space
+        if done["log"] and database.log_fts_enabled:
+            while await asyncio.to_thread(self._fts_merge_step): await asyncio.sleep(PAUSE)
+        if any(done.values()): await self.vacuum()
+        return done
+
+    async def _drain(self, step, cutoff):
+        total = 0
+        while True:
+            n = await asyncio.to_thread(step, cutoff)
+            total += n
+            if n < BATCH: return total
+            await asyncio.sleep(PAUSE)
+
+    def _archive(self, model, where, month_field, table, start_field=None):
+        with read_engine.connect() as conn:
+            rows = [dict(r) for r in conn.execute(select(model.__table__).where(where).order_by(model.id).limit(BATCH)).mappings()]
+        if not rows: return 0
+        # Archive first: a crash before the delete leaves duplicates, which readers skip
+        archive.append(table, rows, month_field, start_field)
+        with Session(engine) as session:
+            session.execute(delete(model).where(model.id.in_([r["id"] for r in rows])))
+            session.commit()
+        metrics.rows_archived.labels(table).inc(len(rows))
+        return len(rows)
+
+    def _archive_logs(self, cutoff):
+        return self._archive(Log, Log.timestamp < cutoff, "timestamp", "log")
+
+    def _archive_downtime(self, cutoff):
+        # Open events stay, however old; they are still being written
+        return self._archive(DowntimeEvent, DowntimeEvent.end_time < cutoff, "end_time", "downtimeevent", "start_time")
+
+    def _purge_outbox(self, cutoff):
+        with Session(engine) as session:
+            ids = session.exec(select(AlertOutbox.id).where(AlertOutbox.status != "pending", AlertOutbox.created_at < cutoff).limit(BATCH)).all()
+            if ids: session.execute(delete(AlertOutbox).where(AlertOutbox.id.in_(ids)))
+            session.commit()
+        return len(ids)
+
+    def _fts_merge_step(self):
+        conn = engine.raw_connection()
+        try:
+            db = conn.driver_connection
+            before = db.total_changes
+            db.execute(f"INSERT INTO log_fts(log_fts, rank) VALUES ('merge', -{FTS_MERGE_PAGES})")
+            db.commit()
+            return db.total_changes - before >= 2
+        finally:
+            conn.close()
+
+    def _vacuum_step(self):
+        conn = engine.raw_connection()
+        try:
+            # executescript steps the pragma to completion; a plain execute frees a single page
+            conn.driver_connection.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES});")
+            return conn.driver_connection.execute("PRAGMA freelist_count").fetchone()[0]
+        finally:
+            conn.close()
+
+    async def vacuum(self):
+        """Releases free pages a step at a time (needs auto_vacuum=INCREMENTAL, see tools/compact.py)."""
+        if self.incremental is None:
+            self.incremental = await asyncio.to_thread(database.incremental_vacuum_enabled)
+            # SQLite still reuses the freed pages, the file just stays at its peak size
+            if not self.incremental: print("Retention: database is not in incremental auto_vacuum mode, freed space stays in the file. "
+                                           "Run `python -m tools.compact` once with the service stopped to switch it.")
+        if not self.incremental: return
+        left = None
+        while True:
+            free = await asyncio.to_thread(self._vacuum_step)
+            if not free or free == left: return
+            left = free
+            await asyncio.sleep(PAUSE)
+
+retention = Retention()
@@ -0,0 +1,86 @@
+from collections import defaultdict
+from datetime import timedelta
+from sqlmodel import Session, select, update, delete, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from database import engine, DowntimeEvent, DowntimeHourly
+
+HOUR = timedelta(hours=1)
+BUCKET_FORMATS = {"hour": "%Y-%m-%d %H:00", "day": "%Y-%m-%d", "month": "%Y-%m"}
+
+def hour_floor(ts):
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+def hour_ceil(ts):
+    floor = hour_floor(ts)
+    return floor if floor == ts else floor + HOUR
+
+def split_hours(start, end):
+    """Yields (hour, minutes) for every hour bucket touched by [start, end)."""
+    cur = hour_floor(start)
+    while cur < end:
+        nxt = cur + HOUR
+        mins = (min(end, nxt) - max(start, cur)).total_seconds() / 60
+        if mins > 0: yield cur, mins
+        cur = nxt
+
+def add_intervals(session, intervals, sign=1):
+    """Adds closed (camera_id, start, end) intervals to the hourly rollup with one upsert (sign=-1 takes them out)."""
+    acc = defaultdict(float)
+    for cam_id, start, end in intervals:
+        for hour, mins in split_hours(start, end): acc[(cam_id, hour)] += sign * mins
+    if not acc: return 0
+    stmt = sqlite_insert(DowntimeHourly)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["camera_id", "hour"],
+        set_={"minutes": DowntimeHourly.minutes + stmt.excluded.minutes},
+    )
+    session.execute(stmt, [{"camera_id": c, "hour": h, "minutes": m} for (c, h), m in acc.items()])
+    return len(acc)
+
+def close_open_events(session, ends):
+    """Closes the open DowntimeEvent of each camera in {camera_id: end_time} and rolls the finished interval up."""
+    if not ends: return
+    open_evts = session.exec(select(DowntimeEvent.id, DowntimeEvent.camera_id, DowntimeEvent.start_time).where(
+        DowntimeEvent.camera_id.in_(list(ends)), DowntimeEvent.end_time == None)).all()
+    if not open_evts: return
+    session.execute(update(DowntimeEvent), [{"id": e.id, "end_time": max(ends[e.camera_id], e.start_time)} for e in open_evts])
+    add_intervals(session, [(e.camera_id, e.start_time, max(ends[e.camera_id], e.start_time)) for e in open_evts])
+
+def reopen_events(session, ends):
+    """Reopens each camera's event that ended at {camera_id: end_time}, taking it back out of the rollup.
+
+    Returns the camera ids that had such an event.
+    """
+    if not ends: return set()
+    evts = session.exec(select(DowntimeEvent.id, DowntimeEvent.camera_id, DowntimeEvent.start_time, DowntimeEvent.end_time).where(
+        DowntimeEvent.camera_id.in_(list(ends)), DowntimeEvent.end_time.in_(set(ends.values())))).all()
+    evts = {e.camera_id: e for e in evts if e.end_time == ends[e.camera_id]}
+    if not evts: return set()
+    session.execute(update(DowntimeEvent), [{"id": e.id, "end_time": None} for e in evts.values()])
+    add_intervals(session, [(e.camera_id, e.start_time, e.end_time) for e in evts.values()], sign=-1)
+    return set(evts)
+
+def rebuild(session, chunk=5000):
+    session.execute(delete(DowntimeHourly))
+    stmt = select(DowntimeEvent.camera_id, DowntimeEvent.start_time, DowntimeEvent.end_time).where(DowntimeEvent.end_time != None)
+    batch = []
+    for row in session.exec(stmt.execution_options(yield_per=chunk)):
+        batch.append(tuple(row))
+        if len(batch) >= chunk:
+            add_intervals(session, batch); batch = []
+    add_intervals(session, batch)
+
+def ensure_rollup():
+    # Backfill once for databases created before the rollup existed
+    with Session(engine) as session:
+        if session.exec(select(DowntimeHourly.camera_id).limit(1)).first() is not None: return
+        if session.exec(select(DowntimeEvent.id).where(DowntimeEvent.end_time != None).limit(1)).first() is None: return
+        rebuild(session)
+        session.commit()
+
+def rollup_minutes(session, start_hour, end_hour, camera_ids=None):
+    """{camera_id: minutes} of closed events over whole hours [start_hour, end_hour)."""
+    stmt = select(DowntimeHourly.camera_id, func.sum(DowntimeHourly.minutes)).where(
+        DowntimeHourly.hour >= start_hour, DowntimeHourly.hour < end_hour).group_by(DowntimeHourly.camera_id)
+    if camera_ids is not None: stmt = stmt.where(DowntimeHourly.camera_id.in_(camera_ids))
+    return dict(session.exec(stmt).all())
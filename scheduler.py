@@ -0,0 +1,67 @@
+import random
+import time
+
+MAX_BACKOFF = 600          # seconds between polls of an NVR that keeps failing
+CONFIRM_DELAY = 10         # re-poll this soon after a camera changed state
+BATCH_WINDOW = 0.5         # NVRs due within this window are polled together
+
+class NVRSchedule:
+    __slots__ = ("ip", "interval", "next_due", "failures")
+
+    def __init__(self, ip, interval, next_due):
+        self.ip = ip
+        self.interval = interval
+        self.next_due = next_due
+        self.failures = 0
+
+class PollScheduler:
+    """Gives every NVR its own next-due time.
+
+    Healthy NVRs are polled every `interval` seconds with +-10% jitter; new
+    NVRs are spread over the first few seconds. Failing NVRs back off
+    exponentially up to MAX_BACKOFF. An NVR that just reported a state change
+    is re-polled after CONFIRM_DELAY.
+    """
+
+    def __init__(self, default_interval=60, clock=time.monotonic):
+        self.default_interval = default_interval
+        self.clock = clock
+        self.nvrs = {}
+
+    def _jitter(self, interval):
+        return interval * random.uniform(0.9, 1.1)
+
+    def sync(self, nvrs, default_interval=None):
+        """Tracks the enabled NVR list; `nvrs` are (ip, interval_override) pairs."""
+        if default_interval: self.default_interval = default_interval
+        now = self.clock()
+        seen = set()
+        for ip, override in nvrs:
+            seen.add(ip)
+            interval = override or self.default_interval
+            s = self.nvrs.get(ip)
+            if s is None:
+                self.nvrs[ip] = NVRSchedule(ip, interval, now + random.uniform(0, min(interval, 10)))
+            elif s.interval != interval:
+                s.next_due = min(s.next_due, now + self._jitter(interval))
+                s.interval = interval
+        for ip in [ip for ip in self.nvrs if ip not in seen]: del self.nvrs[ip]
+
+    def due(self):
+        horizon = self.clock() + BATCH_WINDOW
+        return [ip for ip, s in self.nvrs.items() if s.next_due <= horizon]
+
+    def seconds_until_next(self):
+        if not self.nvrs: return None
+        return max(0.0, min(s.next_due for s in self.nvrs.values()) - self.clock())
+
+    def on_result(self, ip, ok, changed=False):
+        s = self.nvrs.get(ip)
+        if s is None: return
+        now = self.clock()
+        if not ok:
+            s.failures += 1
+            s.next_due = now + min(s.interval * 2 ** (s.failures - 1), max(MAX_BACKOFF, s.interval))
+            return
+        s.failures = 0
+        s.next_due = now + (min(CONFIRM_DELAY, s.interval) if changed else self._jitter(s.interval))
@@ -0,0 +1,92 @@
+import asyncio
+import math
+import os
+import socket
+from datetime import datetime, timedelta
+from sqlalchemy import delete, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session, select
+from database import engine, read_engine, NVR, NVRLease, MonitorWorker
+
+LEASE = timedelta(seconds=30)   # a worker that misses renewals this long loses its NVRs
+RENEW_EVERY = 10                # seconds; renewals run on their own, however long a poll cycle takes
+MARGIN = timedelta(seconds=5)   # a lease this close to expiry no longer counts as held
+
+class LeaseShard:
+    """This worker's share of the NVR table, held through renewable leases.
+
+    Each renew() heartbeats, works out a fair share (NVRs / live workers),
+    gives back any excess and claims free or expired leases up to that share.
+    Claims are a conditional upsert, so two workers can never both win one NVR.
+    start() renews in a background task; held() is what the poll loop may write for.
+    """
+
+    def __init__(self, name=None):
+        self.id = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.owned = set()
+        self.expires = None
+        self.task = None
+
+    def held(self):
+        """NVR ips whose lease is still safely ours (empty once renewals have stalled)."""
+        if self.expires is None or datetime.now() + MARGIN >= self.expires: return set()
+        return self.owned
+
+    def _renew_enabled(self):
+        with Session(read_engine) as session:
+            ips = session.exec(select(NVR.ip).where(NVR.enabled == True)).all()
+        return self.renew(ips)
+
+    async def start(self):
+        await asyncio.to_thread(self._renew_enabled)
+        self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(RENEW_EVERY)
+            try: await asyncio.to_thread(self._renew_enabled)
+            except Exception as e: print(f"Lease renew error: {e}")
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try: await self.task
+            except asyncio.CancelledError: pass
+            self.task = None
+
+    def renew(self, nvr_ips):
+        """Returns the set of NVR ips this worker owns until the next renew."""
+        now = datetime.now()
+        expires = now + LEASE
+        with Session(engine) as session:
+            session.execute(sqlite_insert(MonitorWorker).values(id=self.id, heartbeat=now)
+                            .on_conflict_do_update(index_elements=["id"], set_={"heartbeat": now}))
+            session.execute(delete(MonitorWorker).where(MonitorWorker.heartbeat < now - 10 * LEASE))
+            live = session.exec(select(MonitorWorker.id).where(MonitorWorker.heartbeat >= now - LEASE)).all()
+            target = math.ceil(len(nvr_ips) / max(len(live), 1))
+
+            held = session.exec(select(NVRLease).where(NVRLease.expires >= now)).all()
+            owned = sorted(l.nvr_ip for l in held if l.owner == self.id and l.nvr_ip in nvr_ips)
+            # Hand back NVRs that were removed or exceed our share
+            keep, release = owned[:target], owned[target:]
+            release += [l.nvr_ip for l in held if l.owner == self.id and l.nvr_ip not in nvr_ips]
+            if release: session.execute(delete(NVRLease).where(NVRLease.owner == self.id, NVRLease.nvr_ip.in_(release)))
+            if keep: session.execute(update(NVRLease).where(NVRLease.owner == self.id, NVRLease.nvr_ip.in_(keep)).values(expires=expires))
+
+            taken = {l.nvr_ip for l in held}
+            free = [ip for ip in nvr_ips if ip not in taken][:target - len(keep)]
+            if free:
+                stmt = sqlite_insert(NVRLease).values([{"nvr_ip": ip, "owner": self.id, "expires": expires} for ip in free])
+                session.execute(stmt.on_conflict_do_update(
+                    index_elements=["nvr_ip"], set_={"owner": stmt.excluded.owner, "expires": stmt.excluded.expires},
+                    where=NVRLease.expires < now))
+            session.commit()
+            self.owned = set(session.exec(select(NVRLease.nvr_ip).where(NVRLease.owner == self.id, NVRLease.expires >= now)).all())
+            self.expires = expires
+            return self.owned
+
+    def release_all(self):
+        with Session(engine) as session:
+            session.execute(delete(NVRLease).where(NVRLease.owner == self.id))
+            session.execute(delete(MonitorWorker).where(MonitorWorker.id == self.id))
+            session.commit()
@@ -2,11 +2,14 @@ const API = '/api';
 let state = {
     settings: [],
     logOffset: 0,
+    logCursor: '',
+    logDone: false,
     logLimit: 50,
     logLoading: false,
     logFilter: '',
     logSearch: '',
-    currentCam: null
+    currentCam: null,
+    cams: {}
 };
 
 // --- INIT ---
@@ -25,7 +28,7 @@ function init() {
 
     // Auto-load dash
     nav('dash');
-    setInterval(fetchDash, 5000);
+    startStream();
 }
 
 // --- NAVIGATION ---
@@ -60,7 +63,25 @@ function jumpToSection(id) {
 // --- DASHBOARD ---
 async function fetchDash() {
     const res = await fetch(`${API}/cameras`);
-    const cams = await res.json();
+    renderDash(await res.json());
+}
+
+// Server pushes a snapshot on connect and only changed cameras after that
+function startStream() {
+    if(!window.EventSource) { setInterval(fetchDash, 5000); return; }
+    const es = new EventSource(`${API}/cameras/stream`);
+    es.addEventListener('snapshot', e => {
+        state.cams = {};
+        JSON.parse(e.data).cameras.forEach(c => state.cams[c.id] = c);
+        renderDash(Object.values(state.cams));
+    });
+    es.addEventListener('delta', e => {
+        JSON.parse(e.data).cameras.forEach(c => state.cams[c.id] = c);
+        renderDash(Object.values(state.cams));
+    });
+}
+
+function renderDash(cams) {
     
     // Stats
     const on = cams.filter(c => c.status === 'Online').length;
@@ -90,7 +111,7 @@ async function fetchDash() {
         
         let cards = '';
         list.sort((a,b) => parseInt(a.channel_id) - parseInt(b.channel_id)).forEach(c => {
-            const st = c.status === 'Online' ? 'online' : 'offline';
+            const st = c.status === 'Flapping' ? 'flapping' : c.status === 'Online' ? 'online' : 'offline';
             const json = encodeURIComponent(JSON.stringify(c));
             cards += `
             <div class="cam-card ${st} imp-${c.importance}" onclick="openCam('${json}')">
@@ -141,16 +162,20 @@ function setupLogs() {
 async function loadLogs(reset = false) {
     if(reset) {
         state.logOffset = 0;
+        state.logCursor = '';
+        state.logDone = false;
         document.getElementById('log-list').innerHTML = '';
         state.logLoading = false;
     }
-    if(state.logLoading) return;
+    if(state.logLoading || state.logDone) return;
     state.logLoading = true;
     document.getElementById('logLoader').style.display = 'block';
 
-    const url = `${API}/logs?limit=${state.logLimit}&offset=${state.logOffset}&q=${state.logFilter || state.logSearch}`;
+    const url = `${API}/logs?limit=${state.logLimit}&before=${encodeURIComponent(state.logCursor)}&q=${encodeURIComponent(state.logFilter || state.logSearch)}`;
     const res = await fetch(url);
     const logs = await res.json();
+    state.logCursor = res.headers.get('X-Next-Cursor') || '';
+    if(!state.logCursor) state.logDone = true;
     state.logLoading = false;
     document.getElementById('logLoader').style.display = 'none';
 
@@ -206,6 +231,13 @@ function genReport() {
     doGenReport(t1/1000, t2/1000);
 }
 
+function exportData(kind, format = 'csv') {
+    const t1 = $('#startDt').pDatepicker('getState').selected.unixDate;
+    const t2 = $('#endDt').pDatepicker('getState').selected.unixDate;
+    if(!t1 || !t2) return alert("Select range");
+    window.location = `${API}/export/${kind}?format=${format}&start=${t1/1000}&end=${t2/1000}`;
+}
+
 async function doGenReport(s, e) {
     const list = document.getElementById('rep-list');
     list.innerHTML = '<div style="text-align:center; padding:20px">Analyzing...</div>';
@@ -257,11 +289,12 @@ function renderConfig() {
     container.innerHTML = '';
     const groups = {
         'Email': ['MAIL_ENABLED', 'MAIL_SERVER', 'MAIL_PORT', 'MAIL_USER', 'MAIL_PASS', 'MAIL_RECIPIENTS', 'MAIL_FIRST_ALERT_DELAY_MINUTES', 'MAIL_LOW_IMPORTANCE_DELAY_MINUTES', 'MAIL_ALERT_FREQUENCY_MINUTES', 'MAIL_MUTE_AFTER_N_ALERTS'],
-        'Telegram': ['TELEGRAM_ENABLED', 'TELEGRAM_BOT_TOKEN', 'TELEGRAM_CHAT_IDS', 'TELEGRAM_PROXY', 'TELEGRAM_FIRST_ALERT_DELAY_MINUTES', 'TELEGRAM_LOW_IMPORTANCE_DELAY_MINUTES', 'TELEGRAM_ALERT_FREQUENCY_MINUTES', 'TELEGRAM_MUTE_AFTER_N_ALERTS']
+        'Telegram': ['TELEGRAM_ENABLED', 'TELEGRAM_BOT_TOKEN', 'TELEGRAM_CHAT_IDS', 'TELEGRAM_PROXY', 'TELEGRAM_FIRST_ALERT_DELAY_MINUTES', 'TELEGRAM_LOW_IMPORTANCE_DELAY_MINUTES', 'TELEGRAM_ALERT_FREQUENCY_MINUTES', 'TELEGRAM_MUTE_AFTER_N_ALERTS'],
+        'Monitor': ['POLL_CONCURRENCY', 'POLL_INTERVAL_SECONDS', 'POLL_EVENTS_ENABLED', 'POLL_RECONCILE_SECONDS', 'FLAP_CONFIRM_POLLS', 'FLAP_WINDOW_MINUTES', 'FLAP_THRESHOLD', 'FLAP_MERGE_SECONDS', 'LOG_RETENTION_DAYS', 'DOWNTIME_RETENTION_DAYS']
     };
 
     for(const [title, keys] of Object.entries(groups)) {
-        let html = `<div class="card" id="sec-${title.toLowerCase()}"><div class="card-header"><h3>${title}</h3><button class="btn btn-sm btn-outline" onclick="testConn('${title.toLowerCase()}')">Test</button></div><div style="padding:15px">`;
+        let html = `<div class="card" id="sec-${title.toLowerCase()}"><div class="card-header"><h3>${title}</h3>${title !== 'Monitor' ? `<button class="btn btn-sm btn-outline" onclick="testConn('${title.toLowerCase()}')">Test</button>` : ''}</div><div style="padding:15px">`;
         
         keys.forEach(k => {
             const item = state.settings.find(s => s.key === k); if(!item) return;
@@ -319,7 +352,7 @@ async function openCam(json) {
     document.getElementById('m-ip').textContent = c.ip;
     document.getElementById('m-nvr').textContent = `NVR ${c.nvr_ip} / Ch ${c.channel_id}`;
     document.getElementById('m-status').textContent = c.status;
-    document.getElementById('m-status').style.color = c.status === 'Online' ? 'var(--success)' : 'var(--danger)';
+    document.getElementById('m-status').style.color = c.status === 'Online' ? 'var(--success)' : c.status === 'Flapping' ? 'var(--warn)' : 'var(--danger)';
     document.getElementById('m-last').textContent = c.last_online ? new Date(c.last_online).toLocaleTimeString() : '-';
     
     // Highlight Importance
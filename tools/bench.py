@@ -0,0 +1,228 @@
+"""End-to-end benchmark of the monitor loop against a simulated NVR fleet.
+
+    python -m tools.bench --sizes 10,100,1000,10000 --duration 60 --out bench.json
+    python -m tools.bench --sizes 1000 --baseline bench.json
+
+Every fleet size runs in its own process, with a fresh database in a temp dir
+and the fleet (tools/fake_nvr.py) in a second process. Reported per size:
+cycle duration (poll start -> commit), DB write statements/rows, peak RSS, and
+latency from a channel flip to its state change (detect) and to the queued
+Telegram alert (alert). Alerts are only queued in the outbox, never sent.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLUMNS = [
+    ("cameras", "cams", "{}"), ("nvrs", "nvrs", "{}"), ("warmup_s", "warmup s", "{:.1f}"),
+    ("polls_per_s", "polls/s", "{:.1f}"), ("cycle_p50_ms", "cycle p50", "{:.0f}"), ("cycle_p95_ms", "cycle p95", "{:.0f}"),
+    ("write_stmts_per_s", "stmts/s", "{:.1f}"), ("write_rows_per_s", "rows/s", "{:.1f}"), ("peak_rss_mb", "rss MB", "{:.0f}"),
+    ("detect_p50_s", "detect p50", "{:.2f}"), ("detect_p95_s", "detect p95", "{:.2f}"),
+    ("alert_p50_s", "alert p50", "{:.2f}"), ("alert_p95_s", "alert p95", "{:.2f}"),
+]
+
+def pct(values, q):
+    if not values: return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(math.ceil(q * len(values))) - 1)]
+
+def fleet_shape(cameras, channels):
+    channels = max(1, min(channels, 64, cameras))
+    return math.ceil(cameras / channels), channels
+
+async def run_one(args):
+    """Runs inside the per-size child process; prints one RESULT json line."""
+    nvr_count, channels = fleet_shape(args.run, args.channels)
+    os.chdir(tempfile.mkdtemp(prefix="hikbench-"))
+    os.makedirs("static", exist_ok=True)
+    sys.path.insert(0, ROOT)
+    from tools.fake_nvr import fleet_subnet
+
+    # Camera names are their IPs so alert lines can be matched back to flips
+    with open("camera_names.csv", "w", encoding="utf-8") as f:
+        f.write("ip,name,importance\n")
+        for i in range(nvr_count):
+            for ch in range(1, channels + 1): f.write(f"{fleet_subnet(i)}.{ch},{fleet_subnet(i)}.{ch},2\n")
+
+    fleet = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "tools.fake_nvr", "--count", str(nvr_count), "--channels", str(channels), "--port", str(args.base_port),
+        "--latency", str(args.latency), "--fail-rate", str(args.fail_rate), "--hang-rate", str(args.hang_rate), "--flap", str(args.flap),
+        cwd=ROOT, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    await fleet.stderr.readline()
+
+    from sqlalchemy import event
+    from sqlmodel import Session, select
+    import database, monitor
+    from database import init_db, engine, read_engine, NVR, Settings, Log, AlertOutbox
+    from main import seed_defaults
+    from config import settings_cache
+    from camera_index import camera_index
+    from camera_events import camera_hub
+    from dispatcher import alert_dispatcher
+    from logsink import log_sink
+    from poller import NVRPoller
+
+    init_db()
+    seed_defaults()
+    overrides = {
+        "POLL_INTERVAL_SECONDS": args.interval, "POLL_CONCURRENCY": args.concurrency, "POLL_EVENTS_ENABLED": "true" if args.events else "false",
+        "FLAP_CONFIRM_POLLS": args.confirm,
+        "TELEGRAM_ENABLED": "true", "TELEGRAM_FIRST_ALERT_DELAY_MINUTES": 0, "TELEGRAM_LOW_IMPORTANCE_DELAY_MINUTES": 0,
+    }
+    with Session(engine) as session:
+        for key, value in overrides.items(): session.get(Settings, key).value = str(value)
+        for i in range(nvr_count): session.add(NVR(ip=f"127.0.0.1:{args.base_port + i}", user="admin", password="admin"))
+        session.commit()
+    settings_cache.reload()
+    alert_dispatcher.start = lambda: None
+
+    writes = {"stmts": 0, "rows": 0}
+    def count_writes(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip()[:6].upper() in ("INSERT", "UPDATE", "DELETE"):
+            writes["stmts"] += 1
+            writes["rows"] += len(parameters) if executemany else 1
+    event.listen(database.engine, "before_cursor_execute", count_writes)
+
+    cycles, polls, pending = [], [0], []
+    poll_all = NVRPoller.poll_all
+    async def timed_poll_all(self, nvrs):
+        pending.append(time.perf_counter())
+        polls[0] += len(nvrs)
+        return await poll_all(self, nvrs)
+    NVRPoller.poll_all = timed_poll_all
+    publish = camera_hub.publish
+    def timed_publish(camera_ids):
+        if pending: cycles.append((time.perf_counter(), time.perf_counter() - pending.pop()))
+        return publish(camera_ids)
+    camera_hub.publish = timed_publish
+
+    flips, unalerted, detect, alerts = {}, {}, [], []
+    async def read_flips():
+        while True:
+            line = await fleet.stdout.readline()
+            if not line: return
+            parts = line.decode().split()
+            if len(parts) != 4 or parts[0] != "FLIP": continue
+            t, ip, online = float(parts[1]), parts[2], parts[3] == "online"
+            flips[(ip, online)] = t
+            if online: unalerted.pop(ip, None)
+            else: unalerted[ip] = t
+
+    async def watch_db():
+        last_log = last_alert = 0
+        while True:
+            await asyncio.sleep(0.2)
+            with Session(read_engine) as session:
+                for row in session.exec(select(Log).where(Log.id > last_log, Log.log_type == "Camera")).all():
+                    last_log = max(last_log, row.id)
+                    m = re.search(r"\(([\d.]+)\)$", row.details or "")
+                    t = m and flips.pop((m.group(1), row.state == "Online"), None)
+                    if t: detect.append(row.timestamp.timestamp() - t)
+                for row in session.exec(select(AlertOutbox).where(AlertOutbox.id > last_alert, AlertOutbox.channel == "telegram")).all():
+                    last_alert = max(last_alert, row.id)
+                    for ip in re.findall(r"🚨 ([\d.]+) \(", row.body or ""):
+                        t = unalerted.pop(ip, None)
+                        if t: alerts.append(row.created_at.timestamp() - t)
+
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(read_flips()), asyncio.create_task(watch_db())]
+    loop_task = asyncio.create_task(monitor.start_monitor_loop())
+    warmup = None
+    while time.perf_counter() - started < args.duration:
+        await asyncio.sleep(0.2)
+        if warmup is None and len(camera_index.by_id) >= nvr_count * channels:
+            warmup = time.perf_counter() - started
+            writes.update(stmts=0, rows=0)
+            steady_from, steady_polls = time.perf_counter(), polls[0]
+    loop_task.cancel()
+    await loop_task
+    await log_sink.stop()
+    for t in tasks: t.cancel()
+    fleet.terminate()
+    await fleet.wait()
+
+    if warmup is None: steady_from, steady_polls, warmup = started, 0, float("nan")
+    elapsed = max(time.perf_counter() - steady_from, 1e-9)
+    steady = [d * 1000 for t, d in cycles if t >= steady_from]
+    result = {
+        "cameras": nvr_count * channels, "nvrs": nvr_count, "channels": channels, "events": args.events, "duration": args.duration,
+        "warmup_s": warmup, "cycles": len(steady), "polls_per_s": (polls[0] - steady_polls) / elapsed,
+        "cycle_p50_ms": pct(steady, 0.5), "cycle_p95_ms": pct(steady, 0.95), "cycle_max_ms": max(steady, default=None),
+        "write_stmts_per_s": writes["stmts"] / elapsed, "write_rows_per_s": writes["rows"] / elapsed,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "detect_p50_s": pct(detect, 0.5), "detect_p95_s": pct(detect, 0.95), "alert_p50_s": pct(alerts, 0.5), "alert_p95_s": pct(alerts, 0.95),
+        "flips_detected": len(detect), "alerts": len(alerts),
+    }
+    print("RESULT " + json.dumps(result), flush=True)
+
+def fmt(fmt_str, value):
+    if value is None or (isinstance(value, float) and math.isnan(value)): return "-"
+    return fmt_str.format(value)
+
+def print_table(results, baseline):
+    base = {r["cameras"]: r for r in baseline}
+    rows = [[label for _, label, _ in COLUMNS]]
+    for r in results:
+        row = []
+        for key, _, f in COLUMNS:
+            cell = fmt(f, r.get(key))
+            old = base.get(r["cameras"], {}).get(key)
+            if key not in ("cameras", "nvrs") and isinstance(old, (int, float)) and old and isinstance(r.get(key), (int, float)):
+                cell += f" ({(r[key] - old) / old * 100:+.0f}%)"
+            row.append(cell)
+        rows.append(row)
+    widths = [max(len(row[i]) for row in rows) for i in range(len(COLUMNS))]
+    for row in rows: print("  ".join(cell.rjust(w) for cell, w in zip(row, widths)))
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", default="10,100,1000,10000", help="comma separated camera counts")
+    ap.add_argument("--channels", type=int, default=64, help="channels per NVR (max 64)")
+    ap.add_argument("--duration", type=float, default=60, help="seconds to run each size")
+    ap.add_argument("--interval", type=int, default=10, help="POLL_INTERVAL_SECONDS for the run")
+    ap.add_argument("--concurrency", type=int, default=32, help="POLL_CONCURRENCY for the run")
+    ap.add_argument("--confirm", type=int, default=2, help="FLAP_CONFIRM_POLLS for the run")
+    ap.add_argument("--events", action="store_true", help="enable the alertStream event mode")
+    ap.add_argument("--latency", type=float, default=0.05, help="mean NVR response time in seconds")
+    ap.add_argument("--fail-rate", type=float, default=0.01)
+    ap.add_argument("--hang-rate", type=float, default=0.0)
+    ap.add_argument("--flap", type=float, default=30, help="average seconds between channel flips per NVR")
+    ap.add_argument("--base-port", type=int, default=20000)
+    ap.add_argument("--out", help="write results as JSON here")
+    ap.add_argument("--baseline", help="JSON from an earlier --out run to compare against")
+    ap.add_argument("--run", type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.run:
+        asyncio.run(run_one(args))
+        return
+
+    baseline = []
+    if args.baseline:
+        with open(args.baseline) as f: baseline = json.load(f)
+    child_args = [f"--{k.replace('_', '-')}={v}" for k, v in vars(args).items() if k not in ("sizes", "out", "baseline", "run", "events")]
+    if args.events: child_args.append("--events")
+    results = []
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        print(f"Running {size} cameras for {args.duration:.0f}s...", file=sys.stderr, flush=True)
+        proc = subprocess.run([sys.executable, "-m", "tools.bench", *child_args, "--run", str(size)], cwd=ROOT, capture_output=True, text=True)
+        line = next((l for l in proc.stdout.splitlines() if l.startswith("RESULT ")), None)
+        if not line:
+            print(proc.stdout[-2000:], proc.stderr[-2000:], file=sys.stderr)
+            continue
+        results.append(json.loads(line[7:]))
+    print_table(results, baseline)
+    if args.out:
+        with open(args.out, "w") as f: json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""Switches an existing database to incremental auto_vacuum, so the retention
+job (retention.py) can give the space of archived rows back to the disk.
+
+    python -m tools.compact
+
+Run it from the app directory with the service stopped: it is one full VACUUM,
+which rewrites the whole file, holds the write lock until done and needs about
+the database's size in free disk. New databases are created incremental.
+"""
+import argparse
+import os
+import sys
+import time
+import database
+from config import settings_cache
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--force", action="store_true", help="switch even though retention is off")
+    args = ap.parse_args()
+    if not os.path.exists(database.sqlite_file_name): sys.exit(f"No database at {database.sqlite_file_name}")
+    if database.incremental_vacuum_enabled():
+        print("Already incremental, nothing to do.")
+        return
+    cfg = settings_cache.reload()
+    if not (cfg.log_retention or cfg.downtime_retention or args.force):
+        sys.exit("LOG_RETENTION_DAYS and DOWNTIME_RETENTION_DAYS are both off, so nothing would be freed. Pass --force to switch anyway.")
+    size = os.path.getsize(database.sqlite_file_name)
+    print(f"Running VACUUM on {database.sqlite_file_name} ({size / 2**20:.0f} MB)...", flush=True)
+    t0 = time.monotonic()
+    database.enable_incremental_vacuum()
+    print(f"Done in {time.monotonic() - t0:.0f}s, now {os.path.getsize(database.sqlite_file_name) / 2**20:.0f} MB.")
+
+if __name__ == "__main__":
+    main()
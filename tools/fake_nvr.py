@@ -0,0 +1,169 @@
+"""A fake Hikvision NVR (or a fleet of them) for trying the monitor without hardware.
+
+Serves the channel status and alertStream ISAPI endpoints behind digest auth.
+
+    python -m tools.fake_nvr --port 18080 --channels 16 --flap 20
+
+then add 127.0.0.1:18080 (user admin / password admin) as an NVR. With
+--count N, NVR i listens on port + i. Every channel flip is printed as
+"FLIP <unix time> <camera ip> <online|offline>".
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import sys
+import time
+from aiohttp import web
+from poller import STATUS_PATH, parse_digest_challenge
+from alertstream import ALERT_STREAM_PATH
+
+BOUNDARY = "boundary"
+
+def fleet_subnet(i):
+    return f"10.{i // 250}.{i % 250}"
+
+def status_xml(channels):
+    parts = [
+        f"<InputProxyChannelStatus><id>{ch}</id><sourceInputPortDescriptor><ipAddress>{ip}</ipAddress></sourceInputPortDescriptor>"
+        f"<online>{'true' if online else 'false'}</online></InputProxyChannelStatus>"
+        for ch, (ip, online) in sorted(channels.items())
+    ]
+    return ('<?xml version="1.0" encoding="UTF-8"?><InputProxyChannelStatusList version="2.0" xmlns="http://www.hikvision.com/ver20/XMLSchema">'
+            + "".join(parts) + "</InputProxyChannelStatusList>").encode()
+
+def event_xml(event_type, channel, active):
+    return (f'<?xml version="1.0" encoding="UTF-8"?><EventNotificationAlert version="2.0" xmlns="http://www.hikvision.com/ver20/XMLSchema">'
+            f"<ipAddress>0.0.0.0</ipAddress><portNo>80</portNo><protocol>HTTP</protocol><channelID>{channel}</channelID>"
+            f"<dateTime>2000-01-01T00:00:00+00:00</dateTime><activePostCount>1</activePostCount><eventType>{event_type}</eventType>"
+            f"<eventState>{'active' if active else 'inactive'}</eventState><eventDescription>{event_type} alarm</eventDescription>"
+            "</EventNotificationAlert>").encode()
+
+def part(body):
+    return f'--{BOUNDARY}\r\nContent-Type: application/xml; charset="UTF-8"\r\nContent-Length: {len(body)}\r\n\r\n'.encode() + body + b"\r\n"
+
+class FakeNVR:
+    def __init__(self, channels=16, user="admin", password="admin", subnet="10.0.0", heartbeat=10, latency=0.0, fail_rate=0.0, hang_rate=0.0, on_flip=None):
+        self.channels = {ch: (f"{subnet}.{ch}", True) for ch in range(1, channels + 1)}
+        self.user = user
+        self.password = password
+        self.realm = "DS-FAKE"
+        self.nonce = os.urandom(8).hex()
+        self.heartbeat = heartbeat
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.hang_rate = hang_rate
+        self.on_flip = on_flip
+        self.listeners = set()
+
+    def authorized(self, request):
+        p = parse_digest_challenge(request.headers.get("Authorization"))
+        if not p or p.get("username") != self.user or p.get("nonce") != self.nonce: return False
+        h = lambda s: hashlib.md5(s.encode()).hexdigest()
+        ha1 = h(f"{self.user}:{self.realm}:{self.password}")
+        ha2 = h(f"{request.method}:{p.get('uri', '')}")
+        if p.get("qop"): expected = h(f"{ha1}:{self.nonce}:{p.get('nc')}:{p.get('cnonce')}:{p['qop']}:{ha2}")
+        else: expected = h(f"{ha1}:{self.nonce}:{ha2}")
+        return p.get("response") == expected
+
+    def challenge(self):
+        return web.Response(status=401, headers={"WWW-Authenticate": f'Digest realm="{self.realm}", nonce="{self.nonce}", qop="auth", algorithm=MD5'})
+
+    def set_online(self, ch, online, event_type="videoloss"):
+        ip, was = self.channels[ch]
+        if was == online: return
+        self.channels[ch] = (ip, online)
+        if self.on_flip: self.on_flip(ip, online)
+        for q in self.listeners: q.put_nowait(event_xml(event_type, ch, not online))
+
+    def flap(self):
+        ch = random.choice(list(self.channels))
+        self.set_online(ch, not self.channels[ch][1], random.choice(["videoloss", "IPCDisconnect"]))
+
+    async def status(self, request):
+        if self.latency: await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if not self.authorized(request): return self.challenge()
+        roll = random.random()
+        if roll < self.hang_rate: await asyncio.sleep(60)
+        elif roll < self.hang_rate + self.fail_rate: return web.Response(status=503)
+        return web.Response(body=status_xml(self.channels), content_type="application/xml")
+
+    async def alert_stream(self, request):
+        if not self.authorized(request): return self.challenge()
+        resp = web.StreamResponse(headers={"Content-Type": f"multipart/mixed; boundary={BOUNDARY}"})
+        await resp.prepare(request)
+        q = asyncio.Queue()
+        self.listeners.add(q)
+        try:
+            while True:
+                try: body = await asyncio.wait_for(q.get(), self.heartbeat)
+                except asyncio.TimeoutError: body = event_xml("videoloss", 0, False)
+                await resp.write(part(body))
+        except (ConnectionResetError, asyncio.CancelledError):
+            pass
+        finally:
+            self.listeners.discard(q)
+        return resp
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get(STATUS_PATH, self.status)
+        app.router.add_get(ALERT_STREAM_PATH, self.alert_stream)
+        return app
+
+class FakeFleet:
+    """`count` FakeNVRs, NVR i on base_port + i with cameras in fleet_subnet(i)."""
+
+    def __init__(self, count, channels, base_port=18080, host="127.0.0.1", **kwargs):
+        self.host = host
+        self.base_port = base_port
+        self.nvrs = [FakeNVR(channels, subnet=fleet_subnet(i), **kwargs) for i in range(count)]
+        self.runners = []
+
+    def addresses(self):
+        return [f"{self.host}:{self.base_port + i}" for i in range(len(self.nvrs))]
+
+    async def start(self):
+        for i, nvr in enumerate(self.nvrs):
+            runner = web.AppRunner(nvr.app(), access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, self.host, self.base_port + i).start()
+            self.runners.append(runner)
+
+    async def stop(self):
+        for runner in self.runners: await runner.cleanup()
+        self.runners = []
+
+async def flapper(nvrs, every):
+    """Flips a random channel on a random NVR, on average every `every` seconds per NVR."""
+    while True:
+        await asyncio.sleep(random.expovariate(len(nvrs) / every))
+        random.choice(nvrs).flap()
+
+def print_flip(ip, online):
+    print(f"FLIP {time.time():.3f} {ip} {'online' if online else 'offline'}", flush=True)
+
+async def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=18080)
+    ap.add_argument("--count", type=int, default=1, help="number of NVRs")
+    ap.add_argument("--channels", type=int, default=16, help="channels per NVR (max 64)")
+    ap.add_argument("--user", default="admin")
+    ap.add_argument("--password", default="admin")
+    ap.add_argument("--latency", type=float, default=0, help="mean seconds before each status response")
+    ap.add_argument("--fail-rate", type=float, default=0, help="fraction of status requests answered with 503")
+    ap.add_argument("--hang-rate", type=float, default=0, help="fraction of status requests that never answer in time")
+    ap.add_argument("--flap", type=float, default=0, help="average seconds between channel flips per NVR (0 = never)")
+    args = ap.parse_args()
+
+    fleet = FakeFleet(args.count, min(args.channels, 64), args.port, args.host, user=args.user, password=args.password,
+                      latency=args.latency, fail_rate=args.fail_rate, hang_rate=args.hang_rate, on_flip=print_flip)
+    await fleet.start()
+    print(f"{args.count} fake NVR(s) with {min(args.channels, 64)} channels on {args.host}:{args.port}-{args.port + args.count - 1}", file=sys.stderr, flush=True)
+    if args.flap: asyncio.create_task(flapper(fleet.nvrs, args.flap))
+    await asyncio.Event().wait()
+
+if __name__ == "__main__":
+    asyncio.run(main())
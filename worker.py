@@ -0,0 +1,63 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+from monitor import start_monitor_loop
+from sharding import LeaseShard
+from logsink import log_sink
+
+def worker_count():
+    try: return max(0, int(os.environ.get("MONITOR_WORKERS", "0")))
+    except ValueError: return 0
+
+async def _run_worker(n):
+    shard = LeaseShard(f"worker{n}-{os.getpid()}")
+    await shard.start()
+    task = asyncio.create_task(start_monitor_loop(shard))
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+    try: await task
+    except asyncio.CancelledError: pass
+    await shard.stop()
+    await log_sink.stop()
+    await asyncio.to_thread(shard.release_all)
+
+def run_worker(n):
+    """Entry point of one shard worker process."""
+    asyncio.run(_run_worker(n))
+
+class WorkerPool:
+    """MONITOR_WORKERS shard worker processes, supervised from the API process."""
+
+    def __init__(self):
+        self.procs = []
+        self.task = None
+
+    def start(self, count):
+        ctx = multiprocessing.get_context("spawn")
+        self.procs = [ctx.Process(target=run_worker, args=(n,), name=f"monitor-worker-{n}", daemon=True) for n in range(count)]
+        for p in self.procs: p.start()
+        self.task = asyncio.create_task(self._supervise())
+
+    async def _supervise(self):
+        # A crashed worker's leases expire and the others pick its NVRs up; restart it to restore capacity
+        ctx = multiprocessing.get_context("spawn")
+        while True:
+            await asyncio.sleep(5)
+            for i, p in enumerate(self.procs):
+                if not p.is_alive():
+                    print(f"Monitor worker {i} exited ({p.exitcode}), restarting")
+                    self.procs[i] = ctx.Process(target=run_worker, args=(i,), name=p.name, daemon=True)
+                    self.procs[i].start()
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try: await self.task
+            except asyncio.CancelledError: pass
+            self.task = None
+        for p in self.procs:
+            if p.is_alive(): p.terminate()
+        for p in self.procs: await asyncio.to_thread(p.join, 10)
+        self.procs = []
+
+worker_pool = WorkerPool()